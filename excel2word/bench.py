@@ -0,0 +1,374 @@
+"""
+性能基准：生成指定形状的 Excel，分阶段计时、记录峰值内存，并与保存的基线对比
+
+    python bench.py                                  # 默认用例，结果打印到终端
+    python bench.py --case large --no-stages -o bench.json   # 结果写成 JSON
+    python bench.py --baseline bench.json            # 与基线对比，变慢超过阈值时退出码为 2
+    python bench.py --rows 8000 --cols 12 --merge-density 0.1 --borders header
+    python bench.py --check                          # 两个读取后端转出的文档是否逐字节相同、
+                                                     # 逐行数组检测与单次扫描的表格区域是否相同、
+                                                     # 按表格拆段并行与顺序转换是否相同，不同时退出码为 3
+
+分阶段计时沿用原来的 python-docx 分步流程（完整加载 → find_tbls → effective_cols →
+取值格式化 → 合并 → set_tbl_borders → 保存），便于定位每一步的开销；
+端到端计时走 excel_to_word 的实际路径（只读流式 + 各种写出方式）。
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import converter
+
+# ---------- 用例 ----------
+CASES = {
+    'small':  dict(rows=300, cols=6, blocks=4, merge_density=0.02, borders='all'),
+    'medium': dict(rows=2000, cols=10, blocks=40, merge_density=0.02, borders='all'),
+    'merges': dict(rows=1000, cols=8, blocks=10, merge_density=0.15, borders='header'),
+    'large':  dict(rows=30000, cols=12, blocks=60, merge_density=0.01, borders='all'),   # 建议加 --no-stages --modes xml,compact
+}
+DEFAULT_CASES = ['small', 'medium', 'merges']
+
+MODES = {   # 端到端写出方式 → excel_to_word 参数
+    'xml': {'writer': 'xml'},
+    'compact': {'writer': 'xml', 'compact': True},
+    'docx': {'writer': 'docx'},
+    'stream': {'writer': 'stream'},
+    'chunked': {'writer': 'stream', 'chunk_rows': 500},
+    'openpyxl': {'writer': 'xml', 'reader': 'openpyxl'},   # 原读取后端，对比读取开销
+}
+
+NOISE_FLOOR = 0.05   # 秒；差值小于此的时间变化不算回退
+
+# ---------- 生成测试工作簿 ----------
+def gen_workbook(path: str, rows: int, cols: int, blocks: int, merge_density: float,
+                 borders: str, seed: int = 0):
+    """
+    生成一个工作表：blocks 个表格块，块之间夹几行说明文字
+    borders: 'all' 每行上边框 / 'header' 仅表头 / 'none' 无边框（靠非空≥2 识别）
+    merge_density: 表格单元格中作为合并左上角的比例
+    """
+    import openpyxl
+    from openpyxl.styles import Border, Side
+
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    line = Border(top=Side(style='thin'), bottom=Side(style='thin'))
+    day0 = datetime.datetime(2024, 1, 1)
+    body = max(1, rows // blocks - 3)     # 每块的数据行数
+
+    r = 1
+    for b in range(blocks):
+        ws.cell(r, 1, f"表 {b + 1}  样例数据说明")
+        r += 2
+        start = r
+        for j in range(cols):             # 表头
+            c = ws.cell(r, j + 1, f"字段{j + 1}")
+            if borders != 'none':
+                c.border = line
+        r += 1
+        for _ in range(body):
+            for j in range(cols):
+                c = ws.cell(r, j + 1)
+                k = rnd.random()
+                if k < 0.1:
+                    pass                  # 空单元格
+                elif k < 0.35:
+                    c.value, c.number_format = rnd.randint(-5000, 9000000), '#,##0'
+                elif k < 0.5:
+                    c.value, c.number_format = rnd.random(), '0.00%'
+                elif k < 0.6:
+                    c.value, c.number_format = day0 + datetime.timedelta(days=rnd.randint(0, 700)), 'yyyy-mm-dd'
+                elif k < 0.75:
+                    c.value = rnd.random() * 1000
+                else:
+                    c.value = f"项目{rnd.randint(0, 999)}"
+                if borders == 'all':
+                    c.border = line
+            r += 1
+        end = r - 1
+
+        # 合并：随机挑左上角，跳过与已有合并重叠的
+        taken = set()
+        for _ in range(int((end - start) * cols * merge_density)):
+            r0, c0 = rnd.randint(start + 1, end), rnd.randint(1, cols)
+            h, w = rnd.randint(1, min(3, end - r0 + 1)), rnd.randint(1, min(3, cols - c0 + 1))
+            area = {(i, j) for i in range(r0, r0 + h) for j in range(c0, c0 + w)}
+            if h * w == 1 or area & taken:
+                continue
+            taken |= area
+            ws.merge_cells(start_row=r0, start_column=c0, end_row=r0 + h - 1, end_column=c0 + w - 1)
+        r += 1
+    wb.save(path)
+
+def case_file(work_dir: str, name: str, params: dict) -> str:
+    """同参数的工作簿只生成一次"""
+    tag = '-'.join(f"{k}{v}" for k, v in sorted(params.items()))
+    path = os.path.join(work_dir, f"{name}-{tag}.xlsx")
+    if not os.path.exists(path):
+        gen_workbook(path + '.part', **params)
+        os.replace(path + '.part', path)
+    return path
+
+# ---------- 计时 ----------
+def staged_convert(path: str) -> dict:
+    """python-docx 分步流程，各阶段单独计时"""
+    import openpyxl
+    from docx import Document
+
+    stats = converter.ConvStats()
+    t = stats.stage
+    with t('load'):
+        wb = openpyxl.load_workbook(path, data_only=True)
+        ws = wb.worksheets[0]
+    with t('find_tbls'):
+        tbls = converter.find_tbls(ws)
+    with t('effective_cols'):
+        cols = [converter.effective_cols(ws, s, e) for s, e in tbls]
+    with t('format'):
+        blocks, paras, covered = [], [], set()
+        for (s, e), n in zip(tbls, cols):
+            rows = [[(converter.fmt_value(c), c.value) for c in row[:n]]
+                    for row in ws.iter_rows(min_row=s, max_row=e)]
+            blocks.append(converter.TblBlock(s, e, n, rows))
+            covered.update(range(s, e + 1))
+        for r in range(1, ws.max_row + 1):
+            if r not in covered:
+                paras.append(' '.join(converter.fmt_value(c) for c in ws[r]).strip())
+    with t('merges'):
+        index = converter.index_merges(converter.read_merges(ws))
+        merges = [converter.tbl_merges(index, b) for b in blocks]
+
+    doc = Document()
+    tables = []
+    with t('cells'):
+        for p in paras:
+            converter.set_para_format(doc.add_paragraph(p))
+        for b in blocks:
+            tbl = doc.add_table(rows=b.end - b.start + 1, cols=b.cols)
+            for tr, src_row in zip(tbl.rows, b.rows):
+                for cell, (text, value) in zip(tr.cells, src_row):
+                    converter.set_cell_format(cell, text, value)
+            tables.append(tbl)
+    with t('merges'):
+        for tbl, ms in zip(tables, merges):
+            for (r, c, h, w) in ms:
+                tbl.cell(r, c).merge(tbl.cell(r + h - 1, c + w - 1))
+    with t('set_tbl_borders'):
+        for tbl in tables:
+            converter.set_tbl_borders(tbl)
+    with t('save'):
+        doc.save(io.BytesIO())
+    wb.close()
+    return stats.times
+
+def end_to_end(path: str, kw: dict) -> float:
+    t0 = time.perf_counter()
+    ok, err = converter.excel_to_word(path, io.BytesIO(), **kw)
+    if not ok:
+        raise RuntimeError(err)
+    return time.perf_counter() - t0
+
+def peak_mb(func, *args) -> float:
+    """tracemalloc 记录的 Python 堆峰值（MB）"""
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+def run_case(path: str, modes, repeat: int, staged: bool) -> dict:
+    res = {'size_kb': round(os.path.getsize(path) / 1024, 1), 'end_to_end': {}, 'peak_mb': {}}
+    for mode in modes:
+        res['end_to_end'][mode] = round(min(end_to_end(path, MODES[mode]) for _ in range(repeat)), 4)
+        res['peak_mb'][mode] = round(peak_mb(end_to_end, path, MODES[mode]), 2)
+    if staged:   # python-docx 分步流程本身就慢，只跑一次
+        res['stages'] = {k: round(v, 4) for k, v in staged_convert(path).items()}
+    return res
+
+# ---------- 读取后端一致性 ----------
+def document_xml(path: str, kw: dict) -> bytes:
+    import zipfile
+    out = io.BytesIO()
+    ok, err = converter.excel_to_word(path, out, **kw)
+    if not ok:
+        raise RuntimeError(err)
+    return zipfile.ZipFile(out).read('word/document.xml')
+
+def conformance(path: str, modes) -> list:
+    """每种写出方式下，'xml' 与 'openpyxl' 两个读取后端的 document.xml 是否相同；返回不同的写出方式"""
+    bad = []
+    for mode in modes:
+        kw = {k: v for k, v in MODES[mode].items() if k != 'reader'}
+        if document_xml(path, dict(kw, reader='xml')) != document_xml(path, dict(kw, reader='openpyxl')):
+            bad.append(mode)
+    return bad
+
+RULE_SETS = [converter.DEFAULT_RULES,            # 检测一致性要覆盖的几组表格判定规则
+             converter.TblRules(min_rows=3, gap=1),
+             converter.TblRules(min_cells=3, border=False, gap=2)]
+
+def detection(path: str) -> list:
+    """find_tbls（逐行数组 + 正则）与 scan_sheet（边读边判）找到的表格区域是否相同；返回不同的规则"""
+    import openpyxl
+    bad = []
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        merges = converter.READERS['xml'].merges(ws)
+        for rules in RULE_SETS:
+            scanned = [(b.start, b.end) for kind, b in converter.scan_sheet(ws, merges, reader='xml',
+                                                                            rules=rules)
+                       if kind == 'tbl']
+            if converter.find_tbls(ws, rules) != scanned:
+                bad.append(str(tuple(rules)))
+    finally:
+        wb.close()
+    return bad
+
+def split_conformance(path: str, modes, workers=3) -> list:
+    """不论大小都拆段（SPLIT_MIN_MB 置 0，只在主进程里判断），并行结果与顺序转换是否相同；返回不同的写出方式"""
+    bad, saved = [], converter.SPLIT_MIN_MB
+    converter.SPLIT_MIN_MB = 0
+    try:
+        for mode in modes:
+            kw = MODES[mode]
+            if kw.get('writer') == 'docx':       # 原实现不走进程池
+                continue
+            if document_xml(path, kw) != document_xml(path, dict(kw, workers=workers)):
+                bad.append('split-' + mode)
+    finally:
+        converter.SPLIT_MIN_MB = saved
+    return bad
+
+def slice_conformance(path: str, rows=7) -> list:
+    """流式写出时表格按 rows 行一段生成（STREAM_ROWS 调小），结果与整表生成是否相同；返回不同的写出方式"""
+    bad, saved = [], converter.STREAM_ROWS
+    converter.STREAM_ROWS = rows
+    try:
+        for compact in (False, True):
+            if document_xml(path, {'writer': 'stream', 'compact': compact}) != \
+                    document_xml(path, {'writer': 'xml', 'compact': compact}):
+                bad.append('slice-compact' if compact else 'slice')
+    finally:
+        converter.STREAM_ROWS = saved
+    return bad
+
+# ---------- 基线对比 ----------
+def flatten(case: dict) -> dict:
+    """{'end_to_end.xml': 秒, 'stages.load': 秒, 'peak_mb.xml': MB, ...}"""
+    return {f"{group}.{k}": v for group in ('end_to_end', 'stages', 'peak_mb')
+            for k, v in case.get(group, {}).items()}
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """返回回退列表 [(用例, 指标, 基线, 当前), ...]，并打印对比表"""
+    regressions = []
+    for name, case in results['cases'].items():
+        old = flatten(baseline.get('cases', {}).get(name, {}))
+        for metric, new in flatten(case).items():
+            if metric not in old:
+                continue
+            base = old[metric]
+            ratio = new / base if base else float('inf')
+            floor = 0 if metric.startswith('peak_mb') else NOISE_FLOOR
+            bad = ratio > 1 + tolerance and new - base > floor
+            print(f"{name:>8} {metric:<26} {base:>10.3f} → {new:>10.3f}  {ratio:6.2f}x{'  ← 回退' if bad else ''}")
+            if bad:
+                regressions.append((name, metric, base, new))
+    return regressions
+
+# ---------- 入口 ----------
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Excel → Word 转换性能基准")
+    ap.add_argument('--case', action='append', choices=sorted(CASES), help="预置用例，可重复；默认 small/medium/merges")
+    ap.add_argument('--rows', type=int, help="自定义用例：总行数")
+    ap.add_argument('--cols', type=int, default=8)
+    ap.add_argument('--blocks', type=int, default=5)
+    ap.add_argument('--merge-density', type=float, default=0.02)
+    ap.add_argument('--borders', choices=['all', 'header', 'none'], default='all')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--modes', default='xml,compact,stream',
+                    help="端到端写出方式，逗号分隔：" + ','.join(MODES) + "（docx 很慢，默认不跑）")
+    ap.add_argument('--no-stages', action='store_true', help="跳过 python-docx 分步计时（大文件很慢）")
+    ap.add_argument('--check', action='store_true',
+                    help="只做读取后端一致性检查：各用例、各写出方式下两个后端的文档逐字节比较")
+    ap.add_argument('--repeat', type=int, default=3, help="端到端每项重复次数，取最小值")
+    ap.add_argument('--work-dir', default=os.path.join(os.path.expanduser('~'), '.cache', 'excel2word-bench'),
+                    help="生成的测试工作簿存放目录")
+    ap.add_argument('-o', '--output', help="结果写入 JSON 文件")
+    ap.add_argument('--baseline', help="与此 JSON 基线对比")
+    ap.add_argument('--tolerance', type=float, default=0.2, help="允许的变慢比例，默认 0.2（20%%）")
+    return ap.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    modes = [m for m in args.modes.split(',') if m]
+    for m in modes:
+        if m not in MODES:
+            sys.exit(f"未知写出方式：{m}")
+
+    cases = {name: CASES[name] for name in (args.case or ([] if args.rows else DEFAULT_CASES))}
+    if args.rows:
+        cases['custom'] = dict(rows=args.rows, cols=args.cols, blocks=args.blocks,
+                               merge_density=args.merge_density, borders=args.borders, seed=args.seed)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    if args.check:
+        failed = 0
+        for name, params in cases.items():
+            path = case_file(args.work_dir, name, params)
+            bad = (conformance(path, modes) + ['rules' + r for r in detection(path)]
+                   + split_conformance(path, modes) + slice_conformance(path))
+            failed += len(bad)
+            print(f"[{name}] " + ('一致' if not bad else '不一致：' + ','.join(bad)), file=sys.stderr)
+        return 3 if failed else 0
+
+    import docx
+    import openpyxl
+    results = {
+        'meta': {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'openpyxl': openpyxl.__version__,
+            'python-docx': getattr(docx, '__version__', ''),
+            'repeat': args.repeat,
+        },
+        'cases': {},
+    }
+    for name, params in cases.items():
+        path = case_file(args.work_dir, name, params)
+        res = run_case(path, modes, args.repeat, not args.no_stages)
+        res['params'] = params
+        results['cases'][name] = res
+        line = '  '.join(f"{k} {v:.3f}s" for k, v in res['end_to_end'].items())
+        print(f"[{name}] {res['size_kb']} KB  {line}", file=sys.stderr)
+        if 'stages' in res:
+            print("    " + '  '.join(f"{k} {v:.3f}s" for k, v in res['stages'].items()), file=sys.stderr)
+        print("    peak " + '  '.join(f"{k} {v:.1f}MB" for k, v in res['peak_mb'].items()), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+    else:
+        print(json.dumps(results, ensure_ascii=False, indent=1))
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} 项指标回退超过 {args.tolerance:.0%}", file=sys.stderr)
+            return 2
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
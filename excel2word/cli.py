@@ -0,0 +1,218 @@
+"""
+命令行批量转换，不依赖 streamlit，适合 cron 定时跑整目录
+
+    python cli.py 报表目录/ -o 输出目录 --jobs 8 --skip-unchanged hash
+    python cli.py "exports/**/*.xlsx" -o out --compact
+    python cli.py 月报.xlsx -o out --sheets all      # 全部工作表，多个工作表并行处理
+    python cli.py 流水.xlsx -o out --writer stream --chunk-rows 5000   # 几十万行的大表
+    python cli.py 流水.xlsx -o out --preview        # 只检测：列出表格区域、预计耗时和输出大小
+
+定时重转修订版时可设 E2W_FRAG_CACHE_DIR=目录：没改动的表格直接取上次生成的片段，跨次运行也有效
+
+openpyxl / python-docx 只在真正转换时（工作进程里）才导入，
+`--help`、全部跳过等情况启动很快；加 -v 可以看到启动耗时
+"""
+import time
+
+_T0 = time.perf_counter()
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import List, Tuple
+
+import converter
+
+EXCEL_EXTS = ('.xlsx', '.xls')
+STATE_FILE = '.excel2word-state.json'   # 放在输出目录，记录上次转换时的源文件状态
+
+# ---------- 输入展开 ----------
+def is_excel(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.lower().endswith(EXCEL_EXTS) and not name.startswith('~$')   # 跳过 Excel 锁文件
+
+def collect_inputs(patterns: List[str]) -> List[Tuple[str, str]]:
+    """
+    目录 / 文件 / 通配符 → [(源文件, 相对输出路径), ...]
+    目录按原有子目录结构输出，文件和通配符匹配结果直接放在输出目录下
+    """
+    found = {}
+    for pat in patterns:
+        if os.path.isdir(pat):
+            for root, dirs, files in os.walk(pat):
+                dirs.sort()
+                for name in sorted(files):
+                    src = os.path.join(root, name)
+                    if is_excel(src):
+                        found.setdefault(os.path.abspath(src), os.path.relpath(src, pat))
+        else:
+            matches = [pat] if os.path.isfile(pat) else sorted(glob.glob(pat, recursive=True))
+            for src in matches:
+                if os.path.isfile(src) and is_excel(src):
+                    found.setdefault(os.path.abspath(src), os.path.basename(src))
+    return [(src, os.path.splitext(rel)[0] + '.docx') for src, rel in found.items()]
+
+# ---------- 增量判断 ----------
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_state(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(out_dir: str, state: dict):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + '.part', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.part', path)
+
+def source_record(src: str, mode: str) -> dict:
+    st = os.stat(src)
+    return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size,
+            'sha256': file_sha256(src) if mode == 'hash' else None}
+
+def unchanged(rec: dict, old: dict, mode: str) -> bool:
+    if not old:
+        return False
+    if mode == 'hash':
+        return rec['sha256'] == old.get('sha256')
+    return rec['mtime_ns'] == old.get('mtime_ns') and rec['size'] == old.get('size')
+
+# ---------- 预览 ----------
+def print_preview(inputs: List[Tuple[str, str]], opts: dict) -> int:
+    """逐个文件只做表格检测并打印；返回失败的文件数"""
+    failed = 0
+    for src, _ in inputs:
+        try:
+            sheets = converter.preview_workbook(src, opts.get('sheets'), opts.get('rules'),
+                                                opts.get('reader', 'xml'))
+        except Exception as e:
+            failed += 1
+            print(f"✗ {src}: {e}", file=sys.stderr)
+            continue
+        counts = converter.preview_counts(sheets)
+        secs, size = converter.estimate(counts)
+        print(f"{src}：{counts['tables']} 个表格，{counts['cells']:,} 个单元格，"
+              f"预计 {secs:.1f} 秒、{size / 1024 / 1024:.1f} MB")
+        for sp in sheets:
+            for t in sp.tbls:
+                print(f"  [{sp.title}] 第 {t.start}–{t.end} 行  {t.end - t.start + 1} 行 × {t.cols} 列"
+                      f"  合并 {t.merges}")
+    return failed
+
+# ---------- 入口 ----------
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Excel → Word 批量转换")
+    ap.add_argument('inputs', nargs='+', help="Excel 文件、目录或通配符（如 'data/**/*.xlsx'）")
+    ap.add_argument('-o', '--output', help="输出目录（--preview 时不需要）")
+    ap.add_argument('-j', '--jobs', type=int, default=converter.MAX_WORKERS,
+                    help="并行进程数，默认 CPU 核数；1 表示在当前进程里顺序转换")
+    ap.add_argument('--skip-unchanged', choices=['mtime', 'hash'],
+                    help="跳过自上次转换以来没有变化的文件：按修改时间+大小，或按内容哈希")
+    ap.add_argument('--timeout', type=float, default=converter.FILE_TIMEOUT,
+                    help="单文件超时秒数，0 不限")
+    ap.add_argument('--compact', action='store_true', help="精简输出（文档级样式）")
+    ap.add_argument('--sheets', help="要转换的工作表：all 或逗号分隔的名称/序号（从 1 开始），默认只转第一个")
+    ap.add_argument('--writer', choices=['xml', 'docx', 'stream'], default='xml',
+                    help="表格写出方式；stream 边生成边写进 .docx，超大表格内存不随行数增长")
+    ap.add_argument('--reader', choices=['xml', 'openpyxl'], default='xml',
+                    help="读取方式：xml 直接解析工作表（快）；openpyxl 经过单元格对象（原实现，兜底）")
+    ap.add_argument('--chunk-rows', type=int, default=0,
+                    help="超过这么多行的表格拆成几张表，续表重复原表首行作表头；0 不拆分")
+    ap.add_argument('--min-cells', type=int, default=converter.DEFAULT_RULES.min_cells,
+                    help="无上边框的行，非空单元格达到这么多才算表格行")
+    ap.add_argument('--min-rows', type=int, default=converter.DEFAULT_RULES.min_rows,
+                    help="表格至少这么多行，不够的按普通段落输出")
+    ap.add_argument('--gap', type=int, default=converter.DEFAULT_RULES.gap,
+                    help="表格中间最多容忍这么多个连续的非表格行（空行、说明行），仍算同一张表")
+    ap.add_argument('--preview', action='store_true',
+                    help="不转换，只列出每个文件检测到的表格（行范围、列数、合并数）和预计耗时、输出大小")
+    ap.add_argument('--stats', action='store_true', help="每个文件输出一行 JSON 统计（各阶段耗时、计数）到 stderr")
+    ap.add_argument('--trace-memory', action='store_true', help="统计里加上内存峰值（转换会变慢）")
+    ap.add_argument('-v', '--verbose', action='store_true', help="逐个文件输出结果和启动耗时")
+    args = ap.parse_args(argv)
+    if not args.output and not args.preview:
+        ap.error("缺少输出目录 -o/--output")
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.stats:
+        logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stderr)
+    if args.verbose:
+        print(f"启动耗时 {(time.perf_counter() - _T0) * 1000:.0f} ms", file=sys.stderr)
+
+    opts = {'writer': args.writer, 'compact': args.compact}
+    if args.reader != 'xml':
+        opts['reader'] = args.reader
+    if args.chunk_rows > 0:
+        opts['chunk_rows'] = args.chunk_rows
+    rules = {f: getattr(args, f) for f in ('min_cells', 'min_rows', 'gap')
+             if getattr(args, f) != getattr(converter.DEFAULT_RULES, f)}
+    if rules:
+        opts['rules'] = rules
+    if args.sheets:
+        opts['sheets'] = 'all' if args.sheets == 'all' else [s.strip() for s in args.sheets.split(',') if s.strip()]
+    if args.preview:
+        return 1 if print_preview(collect_inputs(args.inputs), opts) else 0
+    opts_sig = json.dumps([converter.CACHE_VERSION, opts], sort_keys=True)
+    os.makedirs(args.output, exist_ok=True)
+    state = load_state(args.output) if args.skip_unchanged else {}
+
+    jobs, records, skipped = [], [], 0
+    for src, rel in collect_inputs(args.inputs):
+        dst = os.path.join(args.output, rel)
+        if args.skip_unchanged:
+            rec = dict(source_record(src, args.skip_unchanged), opts=opts_sig, output=dst)
+            old = state.get(src)
+            if (old and old.get('opts') == opts_sig and os.path.exists(dst)
+                    and unchanged(rec, old, args.skip_unchanged)):
+                skipped += 1
+                continue
+            records.append(rec)
+        jobs.append((src, dst))
+
+    t0 = time.perf_counter()
+    failed = 0
+    if args.jobs <= 1 or len(jobs) == 1:
+        # 只有一个文件时在当前进程里转，进程数留给它的多个工作表、或大工作表按表格拆成的各段
+        results = ((idx,) + converter.convert_file(job, opts, args.timeout, args.trace_memory,
+                                                   args.jobs)
+                   for idx, job in enumerate(jobs))
+    else:
+        results = converter.convert_in_pool(jobs, opts, args.jobs, args.timeout,
+                                            func=converter.convert_file,
+                                            trace_memory=args.trace_memory)
+    try:
+        for idx, success, error, _, report in results:
+            src, dst = jobs[idx]
+            converter.log_conversion(src, success, report, error=error)
+            if success:
+                if args.skip_unchanged:
+                    state[src] = records[idx]
+                if args.verbose:
+                    print(f"✓ {src} → {dst}", file=sys.stderr)
+            else:
+                failed += 1
+                print(f"✗ {src}: {error}", file=sys.stderr)
+    finally:
+        if args.skip_unchanged:
+            save_state(args.output, state)
+
+    print(f"转换 {len(jobs) - failed} 个，跳过 {skipped} 个，失败 {failed} 个，"
+          f"用时 {time.perf_counter() - t0:.1f} 秒")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
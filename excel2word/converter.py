@@ -0,0 +1,2177 @@
+"""
+Excel → Word 转换引擎：表格检测、取值格式化、OOXML 生成、批量/进程池转换、结果缓存、分阶段统计
+不依赖 streamlit；openpyxl / python-docx 在第一次转换时才导入，导入本模块本身很快
+"""
+from typing import TYPE_CHECKING, Callable, Iterator, List, NamedTuple, Tuple
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal, Context, ROUND_HALF_UP, localcontext
+from functools import lru_cache
+from xml.sax.saxutils import escape
+import warnings
+import io
+import re
+import os
+import time
+import signal
+import hashlib
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import tracemalloc
+
+if TYPE_CHECKING:
+    from array import array
+    from openpyxl.cell.cell import Cell
+
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+log = logging.getLogger('excel2word')
+
+# ---------- 批量转换设置 ----------
+MAX_WORKERS = int(os.environ.get('E2W_WORKERS', 0)) or os.cpu_count() or 1   # 进程池大小
+FILE_TIMEOUT = float(os.environ.get('E2W_FILE_TIMEOUT', 300))                # 单文件超时（秒），0 不限
+STREAM_ROWS = int(os.environ.get('E2W_STREAM_ROWS', 2000))   # 流式写出时超过这么多行的表格逐段生成、边生成边写出；0 整表生成
+SPLIT_MIN_MB = float(os.environ.get('E2W_SPLIT_MIN_MB', 8))   # 工作表 XML（解压后）超过这么大才按表格拆给多个进程
+
+CACHE_VERSION = 3    # 输出格式有变化时加一，旧缓存自动失效
+FRAG_CACHE_MB = float(os.environ.get('E2W_FRAG_CACHE_MB', 64))   # 表格片段缓存（每个进程），0 关闭
+FRAG_CACHE_DIR = os.environ.get('E2W_FRAG_CACHE_DIR', '')          # 表格片段的磁盘层目录，各进程、各次运行共用；留空关闭
+FRAG_CACHE_DISK_MB = float(os.environ.get('E2W_FRAG_CACHE_DISK_MB', 1024))   # 磁盘层上限
+
+# ---------- 边框/非空判断 ----------
+def has_top_border(row: Tuple['Cell', ...]) -> bool:
+    return any(c.border and c.border.top and c.border.top.style for c in row)
+
+def non_empty_cnt(row: Tuple['Cell', ...]) -> int:
+    return sum(1 for c in row if c.value is not None)
+
+# ---------- 表格区域检测 ----------
+class TblRules(NamedTuple):
+    """表格判定规则；默认值即原来写死的规则"""
+    min_cells: int = 2       # 无上边框的行，非空单元格数达到这么多才算表格行
+    border: bool = True      # 有上边框的行直接算表格行
+    min_rows: int = 1        # 表格至少这么多行（首尾表格行之间），不够的按普通段落输出
+    gap: int = 0             # 表格中间最多容忍这么多个连续的非表格行，算进表格里
+
+DEFAULT_RULES = TblRules()
+
+def tbl_rules(rules) -> TblRules:
+    """None / dict（界面、命令行、opts 里用，可以 JSON 序列化）/ TblRules → TblRules"""
+    if rules is None:
+        return DEFAULT_RULES
+    if isinstance(rules, dict):
+        rules = TblRules(**rules)
+    if rules.min_cells < 1 or rules.min_rows < 1 or rules.gap < 0:
+        raise ValueError(f"表格判定规则不合理：{rules}")
+    return rules
+
+class RowMasks(NamedTuple):
+    """逐行紧凑数组，第 i 行在下标 i-1"""
+    border: bytearray        # 有上边框为 1
+    cnt: bytearray           # 非空单元格数，超过 255 记 255
+    last: 'array'            # 最右一个非空单元格的列号，空行为 0
+
+def detect_tbls(masks: RowMasks, rules: TblRules = DEFAULT_RULES) -> List[Tuple[int, int]]:
+    """
+    在逐行数组上检测表格，返回 [(start_row, end_row), ...] 1-based
+    判定与 mark_tbls（单次扫描用）一致：计数查表、与边框按位或得到逐行标记，
+    再用正则找「表格行 (间隔不超过 gap 的非表格行 表格行)*」，丢掉不够 min_rows 行的；
+    全程在 C 里完成，百万行在几十毫秒内
+    """
+    n = len(masks.cnt)
+    hit = masks.cnt.translate(bytes(int(k >= rules.min_cells) for k in range(256)))
+    if rules.border and n:
+        hit = (int.from_bytes(hit, 'big') | int.from_bytes(masks.border, 'big')).to_bytes(n, 'big')
+    run = re.compile(rb'\x01(?:\x00{0,%d}\x01)*' % rules.gap)
+    return [(m.start() + 1, m.end()) for m in run.finditer(hit)
+            if m.end() - m.start() >= rules.min_rows]
+
+def find_tbls(ws, rules: TblRules = DEFAULT_RULES, reader='xml') -> List[Tuple[int, int]]:
+    """
+    返回 [(start_row, end_row), ...] 1-based
+    默认规则：
+        1. 有上边框 → 必为表格行（非空单元格数不限）。
+        2. 无上边框 → 只有非空≥2 才当表格行。
+        3. 表格结束：遇到既无上边框、又非空<2 的行。
+    规则可调，见 TblRules
+    """
+    return detect_tbls(row_masks(ws, READERS[reader].merges(ws), reader), rules)
+
+def mark_tbls(rows, rules: TblRules = DEFAULT_RULES):
+    """
+    给 sheet_rows 产出的逐行数据标上 (是否表格行, 是否表格首行)，判定与 detect_tbls 一致。
+    边读边判，只缓存还没定论的行：不超过 min_rows 行的候选表格、或不超过 gap 行的间隔
+    """
+    pend, start, last, ok = [], 0, 0, False   # start: 候选表格首行（0 = 不在表格中）；ok: 已够 min_rows 行
+    for row in rows:
+        idx, top, cnt = row[0], row[3], row[4]
+        hit = rules.border and top or cnt >= rules.min_cells
+        if not start:
+            if not hit:
+                yield row, False, False
+                continue
+            start = idx
+        elif not hit and idx - last > rules.gap:   # 间隔超出容忍：候选表格到此结束
+            for r in pend:         # 已确认的表格只剩末尾的间隔行；没确认的整段不算表格
+                yield r, False, False
+            pend, start, ok = [], 0, False
+            yield row, False, False
+            continue
+        pend.append(row)
+        if not hit:
+            continue
+        last = idx
+        if ok or idx - start + 1 >= rules.min_rows:
+            for r in pend:
+                yield r, True, not ok
+                ok = True
+            pend = []
+    for r in pend:
+        yield r, False, False
+
+# ---------- 计算有效列数 ----------
+def effective_cols(ws, start_row: int, end_row: int) -> int:
+    """返回当前表格区域里，最右一个非空单元格所在的列号（1-based）"""
+    max_col = 0
+    for row in ws.iter_rows(min_row=start_row, max_row=end_row):
+        for c in range(len(row), 0, -1):          # 从右往左找
+            if row[c - 1].value is not None:
+                max_col = max(max_col, c)
+                break
+    return max_col or 1   # 至少留 1 列
+
+# ---------- Excel 单元格 → 字符串 ----------
+DATE_FMT = '%Y年%m月%d日'
+# openpyxl 的内置格式 44（会计专用）漏了分节的 ;，按 Excel 的原样补上
+_BUILTIN_FIXES = {'_("$"* #,##0.00_)_("$"* \\(#,##0.00\\)_("$"* "-"??_)_(@_)':
+                  '_("$"* #,##0.00_);_("$"* \\(#,##0.00\\);_("$"* "-"??_);_(@_)'}
+_HALF_UP = Context(prec=400, rounding=ROUND_HALF_UP)   # Excel 的舍入：逢五进位，按十进制写法算
+_NONZERO = re.compile(r'[1-9]')
+
+class NumSection(NamedTuple):
+    """number_format 的一节（以 ; 分隔：正数;负数;零;文本）"""
+    prefix: str       # 数字前的字面文本（货币符号、引号里的文字、括号…）
+    suffix: str       # 数字后的字面文本（%、单位…）
+    decimals: int     # 小数位数 = 小数点后的占位符个数
+    thousands: bool   # 千分位
+    scale: int        # 数字后紧跟的逗号个数，每个表示 ÷1000
+    percent: bool
+    sci: bool         # 科学计数
+    digits: bool      # 有没有数字占位符；没有时只输出字面文本
+    zero: bool        # 有没有 0 占位符；没有时值为 0 不显示数字
+    general: bool     # General / @：按原来的两位小数
+
+# 无法照格式输出时（分数、条件节、格式写错）退回原来的写法：百分数 / 千分位 / 两位小数
+def _legacy_section(nf: str) -> NumSection:
+    percent = '%' in nf
+    return NumSection('', '%' if percent else '', 2, ',' in nf and not percent, 0,
+                      percent, False, True, True, False)
+
+def _split_sections(nf: str) -> List[str]:
+    """按引号外的 ; 分节"""
+    secs, buf, quoted = [], [], False
+    for ch in nf:
+        if ch == '"':
+            quoted = not quoted
+        if ch == ';' and not quoted:
+            secs.append(''.join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+    secs.append(''.join(buf))
+    return secs
+
+def _parse_section(sec: str) -> NumSection:
+    """一节格式 → NumSection；遇到不支持的写法（分数、[>=100] 条件、引号或方括号没闭合）抛 ValueError"""
+    prefix, suffix = [], []
+    out = prefix
+    decimals, scale = 0, 0
+    thousands = percent = sci = digits = zero = general = in_frac = False
+    i, n = 0, len(sec)
+    while i < n:
+        ch = sec[i]
+        nxt = sec[i + 1] if i + 1 < n else ' '
+        if ch == '"':                           # "文字"
+            j = sec.find('"', i + 1)
+            if j < 0:
+                raise ValueError(f"引号没有闭合：{sec}")
+            out.append(sec[i + 1:j])
+            i = j + 1
+        elif ch == '\\':                        # \x 转义字符
+            out.append(nxt)
+            i += 2
+        elif ch in '_*':                        # _x 留空、*x 填充，都不输出
+            i += 2
+        elif ch == '[':                         # [Red] 忽略；[$¥-804] 取货币符号
+            j = sec.find(']', i)
+            if j < 0:
+                raise ValueError(f"方括号没有闭合：{sec}")
+            tag = sec[i + 1:j]
+            if tag[:1] in ('<', '>', '='):
+                raise ValueError(f"不支持条件格式：{sec}")
+            if tag.startswith('$'):
+                out.append(tag[1:].split('-')[0])
+            i = j + 1
+        elif sec[i:i + 7].lower() == 'general' or ch == '@':
+            general = True
+            out = suffix
+            i += 1 if ch == '@' else 7
+        elif ch in '0#?':
+            digits, out = True, suffix
+            zero = zero or ch == '0'
+            decimals += in_frac
+            i += 1
+        elif ch == '.' and (digits or nxt in '0#?') and not in_frac:
+            digits, in_frac, out = True, True, suffix
+            i += 1
+        elif ch == ',' and digits:
+            if nxt in '0#?':
+                thousands = True
+            else:
+                scale += 1
+            i += 1
+        elif ch in 'Ee' and digits and nxt in '+-':
+            sci = True
+            i += 2
+            while i < n and sec[i] in '0#?':    # 指数位
+                i += 1
+        elif ch == '/':
+            raise ValueError(f"不支持分数格式：{sec}")
+        else:
+            if ch == '%':
+                percent = True
+            out.append(ch)
+            i += 1
+    return NumSection(''.join(prefix), ''.join(suffix), decimals, thousands, scale,
+                      percent, sci, digits, zero, general)
+
+def _round_fmt(v, spec: str, decimals: int, shift: int) -> str:
+    """
+    非负数 v 乘以 10**shift 后按 spec 格式化，舍入同 Excel：按十进制写法逢五进位（0.5 → 1、2.675 → 2.68），
+    不是 format 的四舍六入五成双。只有第 decimals+1 位小数恰好是 5 时才走 Decimal，其余直接 format
+    """
+    if not shift and type(v) is int:
+        return format(v, spec)
+    s = repr(v)
+    if not shift and spec[-1] == 'f' and 'e' not in s:
+        dot = s.find('.')
+        if dot < 0 or len(s) - dot - 1 <= decimals or s[dot + 1 + decimals] != '5':
+            return format(v, spec)
+    with localcontext(_HALF_UP):
+        return format(Decimal(s).scaleb(shift), spec)
+
+def _section_fn(sec: NumSection):
+    """一节格式 → 输出绝对值的函数（符号由调用方处理）"""
+    prefix, suffix = sec.prefix, sec.suffix
+    if not sec.digits and not sec.general:
+        return lambda v: prefix + suffix
+    decimals = 2 if sec.general else sec.decimals
+    spec = f".{decimals}E" if sec.sci else f"{',' if sec.thousands else ''}.{decimals}f"
+    shift = (2 if sec.percent else 0) - 3 * sec.scale
+    hide_zero = not (sec.zero or sec.general)
+
+    def fn(v):
+        text = _round_fmt(v, spec, decimals, shift)
+        if hide_zero and not _NONZERO.search(text.split('E')[0]):
+            return prefix + suffix
+        return prefix + text + suffix
+    return fn
+
+def _signed(fn):
+    return lambda v: '-' + fn(v)
+
+@lru_cache(maxsize=None)
+def value_formatter(number_format: str):
+    """
+    每种 number_format 只解析一次，返回 值 → 字符串 的函数
+    数字：小数位取自格式，支持千分位、百分比、货币符号/单位、括号负数、零值节、科学计数；
+    General 保持两位小数。文本原样，日期统一为 年月日。
+    舍入逢五进位；分数、条件节等不支持的格式退回 _legacy_section
+    """
+    nf = number_format or 'General'
+    secs = _split_sections(_BUILTIN_FIXES.get(nf, nf))
+    try:
+        if len(secs) > 4:
+            raise ValueError(f"分节过多：{nf}")
+        parsed = [_parse_section(sec) for sec in secs[:3]]
+    except ValueError:
+        parsed = [_legacy_section(nf)]
+    pos = _section_fn(parsed[0])
+    neg = zero = None
+    if len(parsed) > 1:
+        # 负数节一般自带 - 或括号；只有颜色（如 [Red]#,##0）时颜色在 Word 里没了，补上负号
+        neg = _section_fn(parsed[1])
+        lits = parsed[1].prefix + parsed[1].suffix
+        if parsed[1].digits and '-' not in lits and '(' not in lits:
+            neg = _signed(neg)
+    if len(parsed) > 2:
+        zero = _section_fn(parsed[2])
+
+    def num(v):
+        if v < 0:
+            return neg(-v) if neg else '-' + pos(-v)
+        if v == 0 and zero:
+            return zero(0)
+        return pos(v)
+
+    def fmt(v):
+        t = type(v)
+        if t is float or t is int:       # 数字最常见，先判断
+            return num(v)
+        if v is None:
+            return ""
+        if t is str:
+            return v
+        if t is bool:
+            return str(v)
+        if isinstance(v, (int, float)):
+            return num(v)
+        if hasattr(v, 'strftime'):
+            return v.strftime(DATE_FMT)
+        return str(v)
+    return fmt
+
+def fmt_value(cell: 'Cell') -> str:
+    """单个单元格取值/格式化；MergedCell 只有 value（None）"""
+    if cell.value is None:
+        return ""
+    return value_formatter(cell.number_format)(cell.value)
+
+# ---------- 读取 Excel 合并单元格 ----------
+MERGE_CELL_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}mergeCell'
+
+def read_merges(ws) -> List[Tuple[int, int, int, int]]:
+    """
+    返回 [(min_row, min_col, max_row, max_col), ...]  1-based
+    只读模式没有 ws.merged_cells，直接从 sheet XML 里取 <mergeCell>
+    """
+    if hasattr(ws, 'merged_cells'):
+        return [(m.min_row, m.min_col, m.max_row, m.max_col) for m in ws.merged_cells.ranges]
+    from openpyxl.utils import range_boundaries
+    from openpyxl.xml.functions import iterparse
+    rngs = []
+    with ws.parent._archive.open(ws._worksheet_path) as src:
+        for _, el in iterparse(src):
+            if el.tag == MERGE_CELL_TAG:
+                min_col, min_row, max_col, max_row = range_boundaries(el.get('ref'))
+                rngs.append((min_row, min_col, max_row, max_col))
+            el.clear()
+    return rngs
+
+# ---------- 合并区域行索引 ----------
+class MergeIndex(NamedTuple):
+    starts: List[int]                      # 按 min_row 排序后的起始行，供二分
+    rngs: List[Tuple[int, int, int, int]]  # 同序的 (min_row, min_col, max_row, max_col)
+
+def index_merges(merges) -> MergeIndex:
+    """每个 sheet 只建一次；之后每个表格按行区间二分取合并，不再全量扫描"""
+    rngs = sorted(merges)
+    return MergeIndex([m[0] for m in rngs], rngs)
+
+# ---------- 收集 Excel 合并单元格信息 ----------
+def collect_merges(index: MergeIndex, tbl_start: int, tbl_end: int):
+    """
+    返回 [(topRow, leftCol, height, width), ...]  1-based
+    只收集落在当前表格区域内的合并
+    """
+    rngs = []
+    lo = bisect_left(index.starts, tbl_start)
+    hi = bisect_right(index.starts, tbl_end)
+    for (min_row, min_col, max_row, max_col) in index.rngs[lo:hi]:
+        if max_row > tbl_end:
+            continue
+        rngs.append((min_row, min_col,
+                     max_row - min_row + 1,
+                     max_col - min_col + 1))
+    return rngs
+
+def tbl_merges(index: MergeIndex, block) -> List[Tuple[int, int, int, int]]:
+    """
+    当前表格实际要做的合并，返回 [(row, col, height, width), ...] 0-based、相对表格左上角
+    超出有效列数的合并丢弃；分块后的续表第 0 行是重复的表头，只带表头行内的横向合并
+    """
+    off = block.start - (1 if block.head else 0)
+    rngs = [(r - off, c, h, w) for (r, c, h, w) in collect_merges(index, block.start, block.end)]
+    if block.head:
+        rngs[:0] = [(0, c, h, w) for (_, c, h, w) in collect_merges(index, block.head, block.head)]
+    return [(r, c - 1, h, w) for (r, c, h, w) in rngs if c - 1 + w - 1 < block.cols]
+
+# ---------- 单次流式扫描 ----------
+class TblBlock(NamedTuple):
+    start: int                          # 起始行 1-based
+    end: int                            # 结束行 1-based
+    cols: int                           # 有效列数
+    rows: List[List[Tuple[str, object]]]  # 每行 [(文本, 原始值), ...]，只存到最右一个非空单元格
+    head: int = 0                       # 分块后的续表：rows[0] 是重复的表头（原表首行的行号），否则 0
+
+class TblSlice(NamedTuple):
+    """流式写出时大表格的一段行（见 scan_sheet 的 stream_rows），各段按顺序拼起来就是整张表"""
+    block: TblBlock      # 这一段的行；cols 是整张表的有效列数
+    origin: int          # 整张表的起始行
+    first: bool          # 第一段：带表格开头，首行有上边框
+    last: bool           # 最后一段：带表格结尾，末行有粗下边框
+
+# ---------- 读取后端 ----------
+# 后端逐行产出 (行号, [(列号, 值, 样式序号), ...])，行号从 first 起连续、缺的行补空列表；
+# 只列出工作表 XML 里实际有的单元格，行宽以行内最后一个单元格为准（与 openpyxl 只读模式一致）
+def openpyxl_rows(ws, first=1) -> Iterator[Tuple[int, list]]:
+    """openpyxl 后端（原实现）：经过 openpyxl 的单元格对象；完整加载的工作表也能用"""
+    from openpyxl.cell.read_only import EMPTY_CELL
+    read_only = hasattr(ws, 'reset_dimensions')
+    if read_only:
+        ws.reset_dimensions()    # 只读模式：不信任 <dimension>，以实际行为准
+    for idx, row in enumerate(ws.iter_rows(min_row=first), first):
+        yield idx, [(c_idx, c.value, c._style_id if read_only else c.style_id)
+                    for c_idx, c in enumerate(row, 1) if c is not EMPTY_CELL]
+
+_SS_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_MERGE_REF = re.compile(rb'<(?:\w+:)?mergeCell\b[^>]*?\bref="([A-Z]+\d+(?::[A-Z]+\d+)?)"')
+# 只检测表格时用的字节级匹配：行、单元格、属性、单元格有没有值
+_SHEET_DATA = re.compile(rb'<(\w+:)?sheetData\b')
+_ROW_OR_END = re.compile(rb'<(?:\w+:)?row\b([^>]*)>|</(?:\w+:)?sheetData>')
+_ROW_SELF = re.compile(rb'<(?:\w+:)?row\b([^>]*?)/>')
+_CELL_EL = re.compile(rb'<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)', re.S)
+_ATTR_R = re.compile(rb'\br="([A-Z]*)(\d+)"')
+_ATTR_S = re.compile(rb'\bs="(\d+)"')
+_INLINE = re.compile(rb'\bt="inlineStr"')
+_HAS_V = re.compile(rb'<(?:\w+:)?v>[^<]')
+_HAS_IS = re.compile(rb'<(?:\w+:)?is\b')
+
+def _skip_rows(chunks, first: int):
+    """
+    解压后的字节流里去掉行号小于 first 的 <row>，不交给解析器：
+    <sheetData> 之前原样保留（命名空间声明在根元素上），之后从第一个行号 ≥ first 的行接上
+    """
+    buf = b''
+    for chunk in chunks:
+        buf += chunk
+        m = _SHEET_DATA.search(buf)
+        end = buf.find(b'>', m.end()) if m else -1
+        if end >= 0:
+            break
+    else:
+        yield buf
+        return
+    if buf[end - 1:end] == b'/':     # <sheetData/>：没有行
+        yield buf
+        yield from chunks
+        return
+    yield buf[:end + 1]
+    buf = buf[end + 1:]
+    while True:
+        for m in _ROW_OR_END.finditer(buf):
+            r = m.group(1) is not None and _ATTR_R.search(m.group(1))
+            if m.group(1) is None or not r or int(r.group(2)) >= first:   # 没有行号时不敢再跳
+                yield buf[m.start():]
+                yield from chunks
+                return
+        at = buf.rfind(b'<')         # 最后一个标签可能被切断，留到下一块
+        buf = buf[at:] if at >= 0 else b''
+        chunk = next(chunks, b'')
+        if not chunk:
+            yield buf
+            return
+        buf += chunk
+
+def xml_rows(ws, first=1) -> Iterator[Tuple[int, list]]:
+    """
+    原始 XML 后端：expat 边解压边解析工作表 XML，不建 openpyxl 单元格对象。
+    取值规则照搬 openpyxl 只读模式（WorkSheetParser.parse_cell）：数字、共享字符串、布尔、
+    日期（按样式判断）、内联字符串；两个后端转出的文档逐字节相同（bench.py --check）。
+    只支持只读模式打开的工作表，其余情况交给 openpyxl_rows。
+    first > 1 时（并行分段）前面的行只解压、不解析，行号小于 first 的行不产出
+    """
+    if not hasattr(ws, '_worksheet_path'):
+        yield from openpyxl_rows(ws, first)
+        return
+    from xml.parsers import expat
+    from openpyxl.utils.cell import column_index_from_string
+    from openpyxl.utils.datetime import from_excel, from_ISO8601
+
+    wb = ws.parent
+    shared, epoch = ws._shared_strings, wb.epoch
+    date_fmts, delta_fmts = wb._date_formats, wb._timedelta_formats
+    ns = _SS_NS + ' '
+    tag_c, tag_v, tag_row = ns + 'c', ns + 'v', ns + 'row'
+    tag_is, tag_t, tag_rph = ns + 'is', ns + 't', ns + 'rPh'
+    col_of = {}              # 列字母 → 列号
+    done = []                # 解析完、还没产出的行
+    row_idx, cells, cell, text, inline, phonetic = 0, [], None, None, None, False
+
+    def start(name, attrs):
+        nonlocal row_idx, cells, cell, text, inline, phonetic
+        if name == tag_c:
+            ref = attrs.get('r')
+            if ref:
+                letters = ref.rstrip('0123456789')
+                col = col_of.get(letters) or col_of.setdefault(letters, column_index_from_string(letters))
+            else:
+                col = cells[-1][0] + 1 if cells else 1
+            s_id = attrs.get('s', 0)
+            cell = [col, attrs.get('t', 'n'), int(s_id) if s_id else 0, None]
+        elif name == tag_v:
+            text = []
+        elif name == tag_row:
+            r = attrs.get('r')
+            row_idx = int(float(r)) if r else row_idx + 1
+            cells = []
+        elif name == tag_is:
+            inline = []
+        elif name == tag_t and inline is not None and not phonetic:
+            text = []
+        elif name == tag_rph:
+            phonetic = True
+
+    def end(name):
+        nonlocal cell, text, inline, phonetic
+        if name == tag_v:
+            if cell is not None:
+                cell[3] = ''.join(text)
+            text = None
+        elif name == tag_c:
+            col, kind, s_id, raw = cell
+            value = None
+            if kind == 'inlineStr':
+                value = inline
+            elif raw:
+                if kind == 'n':
+                    value = float(raw) if ('.' in raw or 'E' in raw or 'e' in raw) else int(raw)
+                    if s_id in date_fmts:
+                        try:
+                            value = from_excel(value, epoch, timedelta=s_id in delta_fmts)
+                        except (OverflowError, ValueError):
+                            value = "#VALUE!"
+                elif kind == 's':
+                    value = shared[int(raw)]
+                elif kind == 'b':
+                    value = bool(int(raw))
+                elif kind == 'd':
+                    value = from_ISO8601(raw)
+                else:        # str / e
+                    value = raw
+            cells.append((col, value, s_id))
+            cell, inline = None, None
+        elif name == tag_row:
+            done.append((row_idx, cells))
+        elif name == tag_t and text is not None:
+            inline.append(''.join(text))
+            text = None
+        elif name == tag_is:
+            inline = ''.join(inline)
+        elif name == tag_rph:
+            phonetic = False
+
+    def chars(data):
+        if text is not None:
+            text.append(data)
+
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    parser.StartElementHandler, parser.EndElementHandler = start, end
+    parser.CharacterDataHandler = chars
+    counter = first
+    with wb._archive.open(ws._worksheet_path) as src:
+        chunks = iter(lambda: src.read(1 << 16), b'')
+        for chunk in _skip_rows(chunks, first) if first > 1 else chunks:
+            parser.Parse(chunk)
+            for idx, row in done:
+                if idx < counter:        # 行号倒退或重复：openpyxl 跳过；分段时也跳过段前的行
+                    continue
+                for counter in range(counter, idx):
+                    yield counter, []
+                counter = idx + 1
+                yield idx, row
+            done.clear()
+        parser.Parse(b'', True)
+
+def xml_merges(ws) -> List[Tuple[int, int, int, int]]:
+    """
+    原始 XML 后端的合并区域：直接在解压后的字节流里找 <mergeCell ref=…>，不逐元素解析；
+    正文里的 '<' 一定被转义，字节里出现的 <mergeCell 只能是标签
+    """
+    if not hasattr(ws, '_worksheet_path'):
+        return read_merges(ws)
+    from openpyxl.utils import range_boundaries
+    rngs, tail = [], b''
+    with ws.parent._archive.open(ws._worksheet_path) as src:
+        for chunk in iter(lambda: src.read(1 << 20), b''):
+            buf = tail + chunk
+            cut = buf.rfind(b'<')        # 最后一个标签可能被切断，留到下一块
+            tail = buf[cut:]
+            at = buf.find(b'mergeCell', 0, cut)     # <mergeCells> 在 sheetData 之后，前面的块直接跳过
+            if at < 0:
+                continue
+            for ref in _MERGE_REF.findall(buf, buf.rfind(b'<', 0, at), cut):
+                min_col, min_row, max_col, max_row = range_boundaries(ref.decode())
+                rngs.append((min_row, min_col, max_row, max_col))
+        for ref in _MERGE_REF.findall(tail):
+            min_col, min_row, max_col, max_row = range_boundaries(ref.decode())
+            rngs.append((min_row, min_col, max_row, max_col))
+    return rngs
+
+def xml_masks(ws, merges) -> RowMasks:
+    """
+    原始 XML 后端的检测用数组：按 </row> 切开解压后的字节，整行用 bytes.count / 正则计数，
+    只在找最右非空列、或行内有合并单元格时才逐个看单元格；不解码取值。
+    结果与 row_masks 走 sheet_rows 得到的相同（bench.py --check），快好几倍，供预览用
+    """
+    from array import array
+    from openpyxl.utils.cell import column_index_from_string
+    hidden, last_row = _hidden_spans(merges)
+    border, cnt, last = bytearray(), bytearray(), array('I')
+    col_of = {}                  # 列字母 → 列号
+    tops = {s_id: _style_info(ws, s_id)[1] for s_id in range(len(ws.parent._cell_styles) or 1)}
+    framed = {str(s_id).encode() for s_id, top in tops.items() if top}   # 带上边框的样式序号
+    tags = {}                    # 按工作表实际用的命名空间前缀拼好的标签
+
+    def col_at(attrs: bytes, prev: int) -> int:
+        m = _ATTR_R.search(attrs)
+        if not (m and m.group(1)):
+            return prev + 1
+        letters = m.group(1)
+        return col_of.get(letters) or col_of.setdefault(letters, column_index_from_string(letters.decode()))
+
+    def filled(attrs: bytes, inner: bytes) -> bool:
+        return bool(inner) and bool((_HAS_IS if _INLINE.search(attrs) else _HAS_V).search(inner))
+
+    def add_row(idx: int, body: bytes):
+        spans = hidden.pop(idx, None)
+        top_border, n, right = False, 0, 0
+        if body and not spans and not tops.get(0):
+            # 普通行：整行计数，最右非空列从行尾往前找
+            top_border = bool(framed) and not framed.isdisjoint(_ATTR_S.findall(body))
+            n = (body.count(tags['v']) - body.count(tags['v0'])
+                 + body.count(tags['is']) + body.count(tags['is0']))
+            if n and body.count(tags['c']) + body.count(tags['c0']) == body.count(b' r="'):
+                at = body.rfind(tags['v'])
+                while at >= 0 and body.startswith(tags['v0'], at):
+                    at = body.rfind(tags['v'], 0, at)
+                at = max(at, body.rfind(tags['is']), body.rfind(tags['is0']))
+                start = body.rfind(b'<' + tags['pfx'] + b'c', 0, at)
+                right = col_at(body[start:body.index(b'>', start)], 0)
+                body = None
+        if body:
+            # 合并区域内的行、默认样式带边框、有省略列号的单元格：逐个单元格判断
+            top_border, n, right, col = False, 0, 0, 0
+            for attrs, inner in _CELL_EL.findall(body):
+                col = col_at(attrs, col)
+                if spans and any(lo <= col <= hi for lo, hi in spans):
+                    continue
+                m = _ATTR_S.search(attrs)
+                top_border = top_border or tops.get(int(m.group(1)) if m else 0, False)
+                if filled(attrs, inner):
+                    n += 1
+                    right = max(right, col)
+        border.append(top_border)
+        cnt.append(min(n, 255))
+        last.append(right)
+
+    counter = 1
+
+    def add(idx_attrs: bytes, body: bytes):
+        nonlocal counter
+        r = _ATTR_R.search(idx_attrs)
+        idx = int(r.group(2)) if r else counter
+        if idx < counter:        # 行号倒退或重复：与 xml_rows 一样跳过
+            return
+        for counter in range(counter, idx):
+            add_row(counter, b'')
+        counter = idx + 1
+        add_row(idx, body)
+
+    def add_empty(part: bytes):
+        for m in _ROW_SELF.finditer(part):       # <row r="…"/>：没有单元格的行
+            add(m.group(1), b'')
+
+    tail, close = b'', None
+    with ws.parent._archive.open(ws._worksheet_path) as src:
+        for chunk in iter(lambda: src.read(1 << 22), b''):
+            buf = tail + chunk
+            if close is None:
+                m = _SHEET_DATA.search(buf)
+                if m is None:
+                    tail = buf
+                    continue
+                pfx = m.group(1) or b''
+                tags.update(pfx=pfx, v=b'<%sv>' % pfx, v0=b'<%sv></%sv>' % (pfx, pfx),
+                            c=b'<%sc ' % pfx, c0=b'<%sc>' % pfx,
+                            **{'is': b'<%sis>' % pfx, 'is0': b'<%sis/>' % pfx})
+                close, row = b'</%srow>' % pfx, b'<%srow' % pfx
+            parts = buf.split(close)
+            tail = parts.pop()           # 最后一段还没读完整
+            for part in parts:
+                at = part.rfind(row)
+                add_empty(part[:at])
+                end = part.index(b'>', at)
+                add(part[at:end], part[end + 1:])
+        add_empty(tail)
+    for idx in range(counter, last_row + 1):
+        add_row(idx, b'')
+    return RowMasks(border, cnt, last)
+
+# ---------- .xls（BIFF）读取 ----------
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'   # Excel 97-2003 的 OLE2 复合文档文件头
+OPENPYXL_EXTS = ('.xlsx', '.xlsm', '.xltx', '.xltm')
+
+class XlsBook:
+    """xlrd 打开的 .xls，提供流水线用到的 worksheets / close()，用法同 openpyxl 只读工作簿"""
+
+    def __init__(self, excel_file):
+        try:
+            import xlrd
+        except ImportError:
+            raise RuntimeError("读取 .xls 需要安装 xlrd：pip install xlrd") from None
+        from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+        # formatting_info：要边框和数字格式；on_demand：工作表用到时才解析；ragged_rows：行宽以实际单元格为准
+        kw = dict(formatting_info=True, on_demand=True, ragged_rows=True)
+        if isinstance(excel_file, (str, os.PathLike)):
+            self.book = xlrd.open_workbook(os.fspath(excel_file), **kw)
+        else:
+            self.book = xlrd.open_workbook(file_contents=excel_file.read(), **kw)
+        self.epoch = CALENDAR_MAC_1904 if self.book.datemode else CALENDAR_WINDOWS_1900
+        self.worksheets = [XlsSheet(self, i, name) for i, name in enumerate(self.book.sheet_names())]
+
+    def num_format(self, xf_idx: int) -> str:
+        fmt = self.book.format_map.get(self.book.xf_list[xf_idx].format_key)
+        return fmt.format_str if fmt else 'General'
+
+    def close(self):
+        self.book.release_resources()
+
+class XlsSheet:
+    """xls 工作表：title / parent 同 openpyxl，sheet 是 xlrd 的工作表（第一次用时才解析）"""
+
+    def __init__(self, parent: XlsBook, index: int, title: str):
+        self.parent, self.index, self.title = parent, index, title
+
+    @property
+    def sheet(self):
+        return self.parent.book.sheet_by_index(self.index)
+
+def load_book(excel_file, reader='xml'):
+    """
+    按文件头而不是扩展名选读取方式：OLE2（.xls）交给 xlrd，其余用 openpyxl 只读模式打开
+    返回 (工作簿, 实际的 reader)，.xls 的 reader 一律为 'xls'
+    """
+    path = isinstance(excel_file, (str, os.PathLike))
+    if path:
+        with open(excel_file, 'rb') as f:
+            head = f.read(len(OLE2_MAGIC))
+    else:
+        pos = excel_file.tell()
+        head = excel_file.read(len(OLE2_MAGIC))
+        excel_file.seek(pos)
+    if head == OLE2_MAGIC:
+        return XlsBook(excel_file), 'xls'
+    import openpyxl
+    if path and not os.fspath(excel_file).lower().endswith(OPENPYXL_EXTS):
+        # 扩展名不对的 xlsx（如改名成 .xls）：openpyxl 按扩展名拒收文件名，交给它文件内容
+        with open(excel_file, 'rb') as f:
+            excel_file = io.BytesIO(f.read())
+    return openpyxl.load_workbook(excel_file, read_only=True, data_only=True), reader
+
+def xls_merges(ws: XlsSheet) -> List[Tuple[int, int, int, int]]:
+    """xlrd 的 (首行, 末行+1, 首列, 末列+1) 0-based → (min_row, min_col, max_row, max_col) 1-based"""
+    return [(rlo + 1, clo + 1, rhi, chi) for rlo, rhi, clo, chi in ws.sheet.merged_cells]
+
+def xls_rows(ws: XlsSheet, first=1) -> Iterator[Tuple[int, list]]:
+    """
+    xls 后端：xlrd 逐行取单元格，样式序号即 XF 序号。取值向 openpyxl 读 xlsx 看齐：
+    整数值的数字为 int，日期按工作簿的日期基准转 datetime（时长格式转 timedelta），错误值为 #DIV/0! 之类的文本；
+    只有格式没有值的单元格（BLANK）照样列出，值为 None，边框照算
+    """
+    import xlrd
+    from openpyxl.styles.numbers import is_timedelta_format
+    from openpyxl.utils.datetime import from_excel
+    book = ws.parent
+    sh = ws.sheet
+    deltas = {}              # XF 序号 → 是否时长格式
+    for r in range(first - 1, sh.nrows):
+        cells = []
+        for c_idx, cell in enumerate(sh.row(r), 1):
+            t, v, xf = cell.ctype, cell.value, cell.xf_index
+            if t == xlrd.XL_CELL_EMPTY:
+                continue
+            if t == xlrd.XL_CELL_NUMBER:
+                v = int(v) if v.is_integer() else v
+            elif t == xlrd.XL_CELL_DATE:
+                delta = deltas.get(xf)
+                if delta is None:
+                    delta = deltas[xf] = is_timedelta_format(book.num_format(xf))
+                v = from_excel(v, book.epoch, timedelta=delta)
+            elif t == xlrd.XL_CELL_BOOLEAN:
+                v = bool(v)
+            elif t == xlrd.XL_CELL_ERROR:
+                v = xlrd.error_text_from_code.get(v, '#N/A')
+            elif t == xlrd.XL_CELL_BLANK:
+                v = None
+            cells.append((c_idx, v, xf))
+        yield r + 1, cells
+
+class Reader(NamedTuple):
+    merges: Callable         # ws → [(min_row, min_col, max_row, max_col), ...]
+    rows: Callable           # ws → 逐行 (行号, [(列号, 值, 样式序号), ...])
+
+READERS = {'openpyxl': Reader(read_merges, openpyxl_rows), 'xml': Reader(xml_merges, xml_rows),
+           'xls': Reader(xls_merges, xls_rows)}
+
+def _style_info(ws, style_id: int):
+    """样式序号 → (格式化函数, 有无上边框)；借一个只读单元格按 openpyxl 的规则取数字格式和边框"""
+    if isinstance(ws, XlsSheet):
+        border = ws.parent.book.xf_list[style_id].border
+        return value_formatter(ws.parent.num_format(style_id)), border.top_line_style != 0
+    from openpyxl.cell.read_only import ReadOnlyCell
+    probe = ReadOnlyCell(ws, 1, 1, None, 'n', style_id)
+    return value_formatter(probe.number_format), has_top_border((probe,))
+
+def _pad_rows(rows, last_row: int):
+    """合并区域超出 sheetData 的行补成空行"""
+    idx = 0
+    for idx, cells in rows:
+        yield idx, cells
+    for idx in range(idx + 1, last_row + 1):
+        yield idx, []
+
+def _hidden_spans(merges):
+    """合并区域里要当作 MergedCell 的单元格：{行号: [(起始列, 结束列), ...]}，以及合并到的最后一行"""
+    hidden, last_row = {}, 0
+    for (min_row, min_col, max_row, max_col) in merges:
+        last_row = max(last_row, max_row)
+        hidden.setdefault(min_row, []).append((min_col + 1, max_col))
+        for r in range(min_row + 1, max_row + 1):
+            hidden.setdefault(r, []).append((min_col, max_col))
+    return hidden, last_row
+
+def sheet_rows(ws, merges, reader='openpyxl', text=True, span=None):
+    """
+    逐行产出 (行号, 各列 (文本, 值), 最右非空列号, 有无上边框, 非空数, 是否在 XML 里)，列表只存到最右非空列；
+    合并区域内除左上角外的单元格按 MergedCell 处理：无值、无上边框。
+    text=False 时不做取值格式化（只检测表格时用），文本一律为空
+    span: (首行, 末行) 只产出这一段（并行分段用），末行为 None 表示到表尾；None 为整张表
+    """
+    styles = {}              # 样式序号 → (格式化函数, 有无上边框)
+    hidden, last_row = _hidden_spans(merges)
+    lo, hi = span or (1, None)
+    empty = ("", None)
+    for idx, cells in _pad_rows(READERS[reader].rows(ws, lo), last_row):
+        if hi and idx > hi:
+            break
+        spans = hidden.pop(idx, None)
+        top_border, present, last = False, bool(cells) or idx <= last_row, 0
+        vals = [empty] * (cells[-1][0] if cells else 0)
+        for c_idx, v, style_id in cells:
+            if c_idx > len(vals) or spans and any(lo <= c_idx <= hi for lo, hi in spans):
+                continue
+            # 每种样式只查一次 number_format / 边框，之后按样式序号直接取
+            memo = styles.get(style_id)
+            if memo is None:
+                memo = styles[style_id] = _style_info(ws, style_id)
+            fmt, top = memo
+            top_border = top_border or top
+            if v is not None:
+                vals[c_idx - 1] = (fmt(v) if text else "", v)
+                last = max(last, c_idx)
+        cnt = sum(1 for _, v in vals if v is not None)
+        del vals[last:]
+        yield idx, vals, last, top_border, cnt, present
+
+def row_masks(ws, merges, reader='xml') -> RowMasks:
+    """读一遍工作表，得到检测用的逐行数组（不做取值格式化）；xml 后端走字节匹配的 xml_masks"""
+    if reader == 'xml' and hasattr(ws, '_worksheet_path'):
+        return xml_masks(ws, merges)
+    from array import array
+    border, cnt, last = bytearray(), bytearray(), array('I')
+    for _, _, right, top, n, _ in sheet_rows(ws, merges, reader, text=False):
+        border.append(top)
+        cnt.append(min(n, 255))
+        last.append(right)
+    return RowMasks(border, cnt, last)
+
+def tbl_widths(masks: RowMasks, rules: TblRules = DEFAULT_RULES, min_rows=0) -> dict:
+    """各表格的有效列数：{首行: 列数}，只列超过 min_rows 行的表格"""
+    return {start: max(masks.last[start - 1:end]) or 1
+            for start, end in detect_tbls(masks, rules) if end - start + 1 > min_rows}
+
+def scan_sheet(ws, merges, chunk_rows=0, reader='openpyxl', rules: TblRules = DEFAULT_RULES,
+               span=None, check=None, stream_rows=0, widths: dict = None) -> Iterator[Tuple[str, object]]:
+    """
+    一次遍历同时完成：表格区域检测、有效列数、边框判断、取值格式化（格式化函数按样式缓存）。
+    产出 ('p', 段落文本)、('tbl', TblBlock) 或大表格的一段 ('rows', TblSlice)，内存只与当前表格（段）大小有关。
+    判定规则与 find_tbls 完全一致（见 TblRules）。
+    chunk_rows > 0 时超过这么多行的表格拆成几张表，续表开头重复原表首行；
+    不在纵向合并中间断开，所以每块最多多出一个合并区域的行数
+    reader: 读取后端，见 READERS
+    span: 只扫描 (首行, 末行) 这一段，见 split_sheet；各段依次拼起来与整张表扫描的结果相同
+    check: 每 1024 行调用一次（取消时抛 Cancelled），大表格扫到一半也能停下
+    stream_rows > 0 且不分块时，超过这么多行的表格不再整表攒着，每攒够这么多行产出一段 ('rows', TblSlice)，
+    同样不在纵向合并中间断开；整表的列数在第一段就要定下来：从 widths（表格首行 → 列数，见 split_sheet）取，
+    没有时另用 row_masks 读一遍检测数组求得
+    """
+    stream_rows = 0 if chunk_rows else stream_rows
+    joined = set()           # 纵向合并的续行，分块、分段时不从这里断开
+    if chunk_rows or stream_rows:
+        for (min_row, _, max_row, _) in merges:
+            joined.update(range(min_row + 1, max_row + 1))
+
+    in_tbl, start, cols, tbl_rows = False, 0, 0, []
+    head, header = 0, None      # 续表表头：原表首行的行号（首块为 0）与内容
+    origin, part = 0, 0         # 分段：整表的起始行、已产出的段数（start 为当前段的起始行）
+    widths = widths or {}
+    idx, blank = 0, 0       # 尚未输出的空行数（表格之后、文件末尾的空行不输出）
+
+    def close(end: int):
+        if part:
+            return 'rows', TblSlice(TblBlock(start, end, cols, tbl_rows), origin, False, True)
+        return 'tbl', TblBlock(start, end, cols or 1, tbl_rows, head)
+
+    for (idx, vals, last, _, _, present), tbl, first in mark_tbls(
+            sheet_rows(ws, merges, reader, span=span), rules):
+        if check is not None and not idx & 1023:
+            check()
+        if tbl and not first:
+            if chunk_rows and idx - start >= chunk_rows and idx not in joined:
+                yield 'tbl', TblBlock(start, idx - 1, cols or 1, tbl_rows, head)
+                head = head or start      # 首块的起始行就是原表首行
+                start, cols, tbl_rows = idx, len(header), [header]
+            elif stream_rows and len(tbl_rows) >= stream_rows and idx not in joined:
+                if not part:
+                    if origin not in widths:
+                        widths = tbl_widths(row_masks(ws, merges, reader), rules)
+                    cols = widths[origin]
+                yield 'rows', TblSlice(TblBlock(start, idx - 1, cols, tbl_rows), origin, not part, False)
+                part += 1
+                start, tbl_rows = idx, []
+            tbl_rows.append(vals)
+            cols = max(cols, last)
+            continue
+        if in_tbl:
+            yield close(idx - 1)
+            in_tbl, tbl_rows = False, []
+        if tbl:
+            for _ in range(blank):
+                yield 'p', ""
+            blank = 0
+            in_tbl, start, cols, tbl_rows = True, idx, last, [vals]
+            head, header, origin, part = 0, vals, idx, 0
+            continue
+
+        if not present:
+            blank += 1
+            continue
+        for _ in range(blank):
+            yield 'p', ""
+        blank = 0
+        yield 'p', ' '.join(t for t, _ in vals).strip()
+
+    if in_tbl:
+        yield close(idx)
+    elif span and span[1]:
+        for _ in range(blank):       # 下一段从表格开始，整表扫描时这些空行会在表格前输出
+            yield 'p', ""
+    elif idx == blank:
+        yield 'p', ""    # 空表：与完整加载一致，输出一个空段落
+
+# ---------- 分阶段统计 ----------
+class ConvStats:
+    """
+    一次转换的统计：各阶段耗时、计数（单元格、合并、边框元素…）、可选的内存峰值
+    trace_memory 用 tracemalloc 记录每个阶段的峰值，转换会慢 2~3 倍，排查问题时再开
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.times, self.counts, self.peaks = {}, {}, {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - t0
+            if self.trace_memory:
+                self.peaks[name] = max(self.peaks.get(name, 0), tracemalloc.get_traced_memory()[1])
+
+    def count(self, name: str, n: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    @contextmanager
+    def tracing(self):
+        """trace_memory 时在这段代码里开启 tracemalloc（外面已开启则沿用）"""
+        start = self.trace_memory and not tracemalloc.is_tracing()
+        if start:
+            tracemalloc.start()
+        try:
+            yield
+        finally:
+            if start:
+                tracemalloc.stop()
+
+    def timed(self, name: str, items):
+        """逐项计时一个生成器：scan_sheet 与写出交替进行，取下一项的时间记到 name"""
+        items = iter(items)
+        while True:
+            with self.stage(name):
+                item = next(items, None)
+            if item is None:
+                return
+            yield item
+
+    def report(self) -> dict:
+        rep = {'seconds': round(sum(self.times.values()), 4),
+               'stages': {k: round(v, 4) for k, v in self.times.items()},
+               'counts': dict(self.counts)}
+        if self.trace_memory:
+            rep['peak_mb'] = round(max(self.peaks.values(), default=0) / 2 ** 20, 2)
+            rep['stage_peak_mb'] = {k: round(v / 2 ** 20, 2) for k, v in self.peaks.items()}
+        return rep
+
+class _NoStats(ConvStats):
+    """不统计时的占位，excel_to_word 里不用到处判断 None"""
+    def __bool__(self):
+        return False
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, n=1):
+        pass
+
+    def tracing(self):
+        return nullcontext()
+
+    def timed(self, name, items):
+        return items
+
+NO_STATS = _NoStats()
+
+def log_conversion(name: str, ok: bool, report: dict = None, **extra):
+    """每次转换输出一行 JSON 日志（logger 'excel2word'，INFO），便于汇总"""
+    log.info(json.dumps({'file': name, 'ok': ok, **extra, **(report or {})}, ensure_ascii=False))
+
+# ---------- 段落样式 ----------
+def set_para_format(p):
+    from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+    from docx.oxml.shared import qn
+    from docx.shared import Pt
+
+    # 段落设置
+    pf = p.paragraph_format
+    pf.space_before = Pt(6)
+    pf.space_after = Pt(6)
+    pf.line_spacing_rule = WD_LINE_SPACING.EXACTLY
+    pf.line_spacing = Pt(18)
+    pf.alignment = WD_ALIGN_PARAGRAPH.LEFT
+
+    # 字体字号设置
+    run = p.runs[0] if p.runs else p.add_run()
+    run.font.size = Pt(10.5)
+    rPr = run._element.get_or_add_rPr()
+    rFonts = rPr.get_or_add_rFonts()
+    rFonts.set(qn('w:ascii'), 'Times New Roman')
+    rFonts.set(qn('w:hAnsi'), 'Times New Roman')
+    rFonts.set(qn('w:eastAsia'), '宋体')
+
+# ---------- Word 表格样式 ----------
+def set_cell_format(cell, text, cell_value):
+    from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+    from docx.oxml import OxmlElement
+    from docx.oxml.shared import qn
+    from docx.shared import Pt
+
+    cell.text = text
+    
+    # 垂直居中
+    tc_pr = cell._tc.get_or_add_tcPr()
+    tcVAlign = OxmlElement('w:vAlign')
+    tcVAlign.set(qn('w:val'), 'center')
+    tc_pr.append(tcVAlign)
+
+    # 表格段落设置
+    p = cell.paragraphs[0]
+    p_format = p.paragraph_format
+    p_format.space_before = Pt(5)
+    p_format.space_after  = Pt(5)
+    p_format.line_spacing_rule = WD_LINE_SPACING.EXACTLY
+    p_format.line_spacing = Pt(12)
+
+    # 表格字体字号设置
+    run = p.runs[0] if p.runs else p.add_run()
+    run.font.size = Pt(10.5)
+    rPr = run._element.get_or_add_rPr()
+    rFonts = rPr.get_or_add_rFonts()
+    rFonts.set(qn('w:ascii'), 'Times New Roman')
+    rFonts.set(qn('w:hAnsi'), 'Times New Roman')
+    rFonts.set(qn('w:eastAsia'), '宋体')
+
+    # 根据单元格值类型设置对齐方式
+    if isinstance(cell_value, (int, float)) and not isinstance(cell_value, bool):
+        p_format.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    else:
+        p_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
+
+# ---------- Word 表格边框 ----------
+def set_tbl_borders(tbl, thick=12, dash=6):
+    from docx.oxml import OxmlElement
+    from docx.oxml.shared import qn
+
+    rows = tbl.rows 
+    if not rows:
+        return
+
+    # 横向边框
+    for cell in rows[0].cells:                 
+        tc_pr = cell._tc.get_or_add_tcPr()     
+        tc_borders = tc_pr.first_child_found_in('w:tcBorders') 
+        if tc_borders is None:                  
+            tc_borders = OxmlElement('w:tcBorders')  
+            tc_pr.append(tc_borders)           
+        top = OxmlElement('w:top')              
+        top.set(qn('w:val'), 'single')
+        top.set(qn('w:sz'), str(thick))
+        top.set(qn('w:color'), '000000')
+        tc_borders.append(top)
+
+        btm = OxmlElement('w:bottom')
+        btm.set(qn('w:val'), 'dotted')
+        btm.set(qn('w:sz'), str(dash))
+        btm.set(qn('w:color'), '000000')
+        tc_borders.append(btm)
+        
+    for row in rows[1:-1]:
+        for cell in row.cells:
+            tc_pr = cell._tc.get_or_add_tcPr()
+            tc_borders = tc_pr.first_child_found_in('w:tcBorders')
+            if tc_borders is None:
+                tc_borders = OxmlElement('w:tcBorders')
+                tc_pr.append(tc_borders)
+            btm = OxmlElement('w:bottom')
+            btm.set(qn('w:val'), 'dotted')
+            btm.set(qn('w:sz'), str(dash))
+            btm.set(qn('w:color'), '000000')
+            tc_borders.append(btm)
+
+    for cell in rows[-1].cells:
+        tc_pr = cell._tc.get_or_add_tcPr()
+        tc_borders = tc_pr.first_child_found_in('w:tcBorders')
+        if tc_borders is None:
+            tc_borders = OxmlElement('w:tcBorders')
+            tc_pr.append(tc_borders)
+        btm = OxmlElement('w:bottom')
+        btm.set(qn('w:val'), 'single')
+        btm.set(qn('w:sz'), str(thick))
+        btm.set(qn('w:color'), '000000')
+        tc_borders.append(btm)
+
+    # 竖向边框
+    for row in rows:
+        for idx, cell in enumerate(row.cells):
+            tc_pr = cell._tc.get_or_add_tcPr()
+            tc_borders = tc_pr.first_child_found_in('w:tcBorders')
+            if tc_borders is None:
+                tc_borders = OxmlElement('w:tcBorders')
+                tc_pr.append(tc_borders)
+
+            if idx != len(row.cells) - 1:
+                right = OxmlElement('w:right')
+                right.set(qn('w:val'), 'dotted')
+                right.set(qn('w:sz'), str(dash))
+                right.set(qn('w:color'), '000000')
+                tc_borders.append(right)
+
+# ---------- 直接生成 OOXML ----------
+# 与 set_para_format / set_cell_format / set_tbl_borders 的输出逐字节一致，
+# 只是不再经过 python-docx 的逐单元格代理对象
+_RPR = ('<w:rPr><w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:eastAsia="宋体"/>'
+        '<w:sz w:val="21"/></w:rPr>')
+_PARA_PPR = ('<w:pPr><w:spacing w:before="120" w:after="120" w:lineRule="exact" w:line="360"/>'
+             '<w:jc w:val="left"/></w:pPr>')
+_CELL_PPR = ('<w:pPr><w:spacing w:before="100" w:after="100" w:lineRule="exact" w:line="240"/>'
+             '<w:jc w:val="%s"/></w:pPr>')
+_CELL_P = {True: '<w:p>' + _CELL_PPR % 'right', False: '<w:p>' + _CELL_PPR % 'left'}
+_TBL_PR = ('<w:tblPr><w:tblW w:type="auto" w:w="0"/><w:tblLook w:firstColumn="1" w:firstRow="1" '
+           'w:lastColumn="0" w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>')
+_SPECIAL_CHARS = re.compile(r'([\t\r\n])')
+_W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'   # = nsdecls('w')
+
+def _border_xml(side, val, sz) -> str:
+    return '<w:%s w:val="%s" w:sz="%d" w:color="000000"/>' % (side, val, sz)
+
+def run_xml(text: str, rpr: str = _RPR) -> str:
+    """与 run.text = text 相同：制表符 → w:tab，换行 → w:br"""
+    parts = [rpr]
+    for chunk in _SPECIAL_CHARS.split(text):
+        if not chunk:
+            continue
+        if chunk == '\t':
+            parts.append('<w:tab/>')
+        elif chunk in '\r\n':
+            parts.append('<w:br/>')
+        elif len(chunk.strip()) < len(chunk):
+            parts.append('<w:t xml:space="preserve">%s</w:t>' % escape(chunk))
+        else:
+            parts.append('<w:t>%s</w:t>' % escape(chunk))
+    return '<w:r>%s</w:r>' % ''.join(parts)
+
+def para_xml(text: str, compact=False) -> str:
+    """正文段落，等价于 add_paragraph(text) + set_para_format"""
+    if compact:
+        return '<w:p %s>%s%s</w:p>' % (_W_NS, _COMPACT_PARA_PPR,
+                                        run_xml(text, '') if text else '')
+    return '<w:p %s>%s%s</w:p>' % (_W_NS, _PARA_PPR, run_xml(text))
+
+def is_right_aligned(cell_value) -> bool:
+    return isinstance(cell_value, (int, float)) and not isinstance(cell_value, bool)
+
+def _tbl_open(tbl_pr: str, col_w: int, n_cols: int) -> List[str]:
+    return ['<w:tbl %s>' % _W_NS, tbl_pr, '<w:tblGrid>', '<w:gridCol w:w="%d"/>' % col_w * n_cols, '</w:tblGrid>']
+
+def tbl_xml(block: TblBlock, col_w: int, merges=(), thick=12, dash=6, compact=False,
+            top=True, bottom=True) -> str:
+    """
+    生成整张表的 w:tbl，等价于 add_table + set_cell_format + 合并 + set_tbl_borders
+    merges: tbl_merges() 的结果，直接写成 gridSpan / vMerge
+    compact=True 时单元格只引用文档样式，边框由表格样式统一给出
+    top / bottom: 为 False 时 block 只是大表格中间的一段（见 TblSlice）：
+    不带表格开头 / 结尾，首行 / 末行按中间行处理；各段拼起来与整表生成的逐字节相同
+    """
+    if merges:
+        return _merged_tbl_xml(block, col_w, merges, thick, dash, compact, top, bottom)
+    if compact:
+        return _compact_tbl_xml(block, col_w, top, bottom)
+    n_rows, n_cols = len(block.rows), block.cols
+    top_xml = _border_xml('top', 'single', thick)
+    dotted_btm = _border_xml('bottom', 'dotted', dash)
+    thick_btm = _border_xml('bottom', 'single', thick)
+    right = _border_xml('right', 'dotted', dash)
+    tc_w = '<w:tcW w:type="dxa" w:w="%d"/><w:vAlign w:val="center"/>' % col_w
+
+    parts = _tbl_open(_TBL_PR, col_w, n_cols) if top else []
+    first, last = 0 if top else -1, n_rows - 1 if bottom else -1
+    empty = ('', None)
+    for r, src_row in enumerate(block.rows):
+        # 与 set_tbl_borders 的追加顺序一致：首行、中间行、末行、竖线
+        btm = (top_xml + dotted_btm if r == first else '') + \
+              (thick_btm if r == last else ('' if r == first else dotted_btm))
+        tc_pr = '<w:tcPr>%s<w:tcBorders>%s%%s</w:tcBorders></w:tcPr>' % (tc_w, btm)
+        tc_prs = [tc_pr % right] * (n_cols - 1) + [tc_pr % '']
+        parts.append('<w:tr>')
+        for c_idx in range(n_cols):
+            cell_text, cell_value = src_row[c_idx] if c_idx < len(src_row) else empty
+            parts.append('<w:tc>%s%s%s</w:p></w:tc>' % (
+                tc_prs[c_idx], _CELL_P[is_right_aligned(cell_value)], run_xml(cell_text)))
+        parts.append('</w:tr>')
+    if bottom:
+        parts.append('</w:tbl>')
+    return ''.join(parts)
+
+# ---------- 精简输出：文档级样式 ----------
+# 字体、间距、对齐写进段落样式，边框和垂直居中写进表格样式，
+# 段落/单元格只引用样式 ID，document.xml 体积与单元格数基本只差文本本身
+_COMPACT_PARA_PPR = '<w:pPr><w:pStyle w:val="E2WBody"/></w:pPr>'
+_COMPACT_CELL_P = {True: '<w:p><w:pPr><w:pStyle w:val="E2WCellRight"/></w:pPr>',
+                   False: '<w:p><w:pPr><w:pStyle w:val="E2WCell"/></w:pPr>'}
+_COMPACT_TBL_PR = ('<w:tblPr><w:tblStyle w:val="E2WTable"/><w:tblW w:type="auto" w:w="0"/>'
+                   '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+                   'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>')
+
+def _compact_styles(thick=12, dash=6) -> List[str]:
+    fonts = ('<w:rPr><w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:eastAsia="宋体"/>'
+             '<w:sz w:val="21"/></w:rPr>')
+    para = ('<w:style %s w:type="paragraph" w:customStyle="1" w:styleId="%s"><w:name w:val="%s"/>'
+            '<w:basedOn w:val="%s"/><w:qFormat/><w:pPr>%s</w:pPr>%s</w:style>')
+    cell_spacing = '<w:spacing w:before="100" w:after="100" w:lineRule="exact" w:line="240"/>'
+    # 整表的上/下边框即首行上边框、末行下边框；insideH/insideV 对应行间点线与列间点线
+    tbl = ('<w:style %s w:type="table" w:customStyle="1" w:styleId="E2WTable"><w:name w:val="E2W Table"/>'
+           '<w:basedOn w:val="TableNormal"/><w:tblPr><w:tblBorders>%s<w:left w:val="nil"/>%s'
+           '<w:right w:val="nil"/>%s%s</w:tblBorders></w:tblPr>'
+           '<w:tcPr><w:vAlign w:val="center"/></w:tcPr></w:style>') % (
+        _W_NS,
+        _border_xml('top', 'single', thick), _border_xml('bottom', 'single', thick),
+        _border_xml('insideH', 'dotted', dash), _border_xml('insideV', 'dotted', dash))
+    return [
+        para % (_W_NS, 'E2WBody', 'E2W Body', 'Normal',
+                '<w:spacing w:before="120" w:after="120" w:lineRule="exact" w:line="360"/>'
+                '<w:jc w:val="left"/>', fonts),
+        para % (_W_NS, 'E2WCell', 'E2W Cell', 'Normal',
+                cell_spacing + '<w:jc w:val="left"/>', fonts),
+        para % (_W_NS, 'E2WCellRight', 'E2W Cell Right', 'E2WCell',
+                '<w:jc w:val="right"/>', ''),
+        tbl,
+    ]
+
+def add_compact_styles(doc):
+    from docx.oxml import parse_xml
+    styles = doc.styles.element
+    for xml in _compact_styles():
+        styles.append(parse_xml(xml))
+
+def _compact_tbl_xml(block: TblBlock, col_w: int, top=True, bottom=True) -> str:
+    n_cols = block.cols
+    tc_pr = '<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="%d"/></w:tcPr>' % col_w
+    parts = _tbl_open(_COMPACT_TBL_PR, col_w, n_cols) if top else []
+    empty = ('', None)
+    for src_row in block.rows:
+        parts.append('<w:tr>')
+        for c_idx in range(n_cols):
+            cell_text, cell_value = src_row[c_idx] if c_idx < len(src_row) else empty
+            parts.append(tc_pr)
+            parts.append(_COMPACT_CELL_P[is_right_aligned(cell_value)])
+            if cell_text:
+                parts.append(run_xml(cell_text, ''))
+            parts.append('</w:p></w:tc>')
+        parts.append('</w:tr>')
+    if bottom:
+        parts.append('</w:tbl>')
+    return ''.join(parts)
+
+# ---------- 带合并的表格 ----------
+def _move_content(src: list, dst: list):
+    """
+    python-docx CT_Tc._move_content_to 的等价实现，单元格内容为 [(段落XML, 是否有 run), ...]
+    只有一个空段落的单元格不搬；目标末尾的空段落先去掉；搬走后源单元格留一个 <w:p/>
+    """
+    if src is dst or (len(src) == 1 and not src[0][1]):
+        return
+    if not dst[-1][1]:
+        dst.pop()
+    dst.extend(src)
+    src[:] = [('<w:p/>', False)]
+
+def _merged_tbl_xml(block: TblBlock, col_w: int, merges, thick, dash, compact, top=True, bottom=True) -> str:
+    """
+    按行直接写出 gridSpan / vMerge，结果与 tbl.cell(...).merge(...) 之后再 set_tbl_borders 完全一致：
+    合并区域内所有单元格的段落按行序并入左上角单元格；续行单元格保留 tcPr、内容搬空；
+    set_tbl_borders 按网格列逐格追加边框，跨列/跨行单元格因此会重复收到同一条边框
+    """
+    n_rows, n_cols = len(block.rows), block.cols
+    empty = ('', None)
+
+    def cell_p(r, c):
+        src_row = block.rows[r]
+        cell_text, cell_value = src_row[c] if c < len(src_row) else empty
+        if compact:
+            return (_COMPACT_CELL_P[is_right_aligned(cell_value)] +
+                    (run_xml(cell_text, '') if cell_text else '') + '</w:p>', bool(cell_text))
+        return _CELL_P[is_right_aligned(cell_value)] + run_xml(cell_text) + '</w:p>', True
+
+    # 网格位置 → 所属合并区域
+    owner = [[None] * n_cols for _ in range(n_rows)]
+    for m in merges:
+        r0, c0, h, w = m
+        for r in range(r0, r0 + h):
+            for c in range(c0, c0 + w):
+                if owner[r][c] is not None:
+                    raise ValueError("合并区域重叠：第 %d 行第 %d 列" % (block.start + r - (1 if block.head else 0), c + 1))
+                owner[r][c] = m
+
+    top_xml = _border_xml('top', 'single', thick)
+    dotted_btm = _border_xml('bottom', 'dotted', dash)
+    thick_btm = _border_xml('bottom', 'single', thick)
+    right = _border_xml('right', 'dotted', dash)
+    lo, hi = (1 if top else 0), n_rows - (2 if bottom else 1)   # 中间行的范围（大表格的一段见 tbl_xml）
+
+    def tc_borders(r0, c0, h, w):
+        # set_tbl_borders 四轮追加：首行(上+点线下)、中间行(点线下)、末行(粗下)、竖线(非末列加右)
+        mid = max(0, min(r0 + h - 1, hi) - max(r0, lo) + 1)
+        n_right = h * (w - (1 if c0 + w == n_cols else 0))
+        return '<w:tcBorders>%s%s%s%s</w:tcBorders>' % (
+            (top_xml + dotted_btm) * (w if top and r0 == 0 else 0), dotted_btm * (w * mid),
+            thick_btm * (w if bottom and r0 + h == n_rows else 0), right * n_right)
+
+    def tc_pr(r0, c0, h, w, vmerge, borders):
+        parts = ['<w:tcPr><w:tcW w:type="dxa" w:w="%d"/>' % (col_w * w)]
+        if w > 1:
+            parts.append('<w:gridSpan w:val="%d"/>' % w)
+        if vmerge:
+            parts.append(vmerge)
+        if not compact:
+            parts.append('<w:vAlign w:val="center"/>')
+            if borders:
+                parts.append(tc_borders(r0, c0, h, w))
+        parts.append('</w:tcPr>')
+        return ''.join(parts)
+
+    parts = _tbl_open(_COMPACT_TBL_PR if compact else _TBL_PR, col_w, n_cols) if top else []
+    pending = {}     # 合并区域 → 各续行单元格的剩余内容
+    for r in range(n_rows):
+        parts.append('<w:tr>')
+        c = 0
+        while c < n_cols:
+            m = owner[r][c]
+            if m is None:
+                parts.append('<w:tc>%s%s</w:tc>' % (tc_pr(r, c, 1, 1, None, True), cell_p(r, c)[0]))
+                c += 1
+                continue
+            r0, c0, h, w = m
+            if r == r0:
+                # 左上角单元格：按 python-docx 的顺序逐行、逐格把内容并进来
+                cells = [[[cell_p(rr, cc)] for cc in range(c0, c0 + w)] for rr in range(r0, r0 + h)]
+                content = cells[0][0]
+                for row_cells in cells:
+                    for cell in row_cells:
+                        _move_content(cell, content)
+                pending[m] = [row_cells[0] for row_cells in cells[1:]]
+                vmerge = '<w:vMerge w:val="restart"/>' if h > 1 else None
+                parts.append('<w:tc>%s%s</w:tc>' % (tc_pr(r0, c0, h, w, vmerge, True),
+                                                     ''.join(x for x, _ in content)))
+            else:
+                rest = pending[m][r - r0 - 1]
+                if r == r0 + h - 1:
+                    del pending[m]
+                parts.append('<w:tc>%s%s</w:tc>' % (tc_pr(r0, c0, h, w, '<w:vMerge/>', False),
+                                                     ''.join(x for x, _ in rest)))
+            c += w
+        parts.append('</w:tr>')
+    if bottom:
+        parts.append('</w:tbl>')
+    return ''.join(parts)
+
+# ---------- 写入一个表格 ----------
+def add_tbl(doc, block: TblBlock, index: MergeIndex, stats: ConvStats = NO_STATS, check=None):
+    """check: 每 1024 行、每 1024 个合并区域调用一次，见 scan_sheet"""
+    tbl_rows, tbl_cols = len(block.rows), block.cols
+    with stats.stage('cells'):
+        tbl = doc.add_table(rows=tbl_rows, cols=tbl_cols)
+
+        for r, (tr, src_row) in enumerate(zip(tbl.rows, block.rows)):
+            if check is not None and not r & 1023:
+                check()
+            dest_cells = tr.cells
+            for c_idx in range(tbl_cols):
+                cell_text, cell_value = src_row[c_idx] if c_idx < len(src_row) else ("", None)
+                set_cell_format(dest_cells[c_idx], cell_text, cell_value)
+
+    with stats.stage('merges'):
+        merges = tbl_merges(index, block)
+        for n, (r, c, h, w) in enumerate(merges):
+            if check is not None and not n & 1023:
+                check()
+            top_left = tbl.cell(r, c)
+            btm_right = tbl.cell(r + h - 1, c + w - 1)
+            top_left.merge(btm_right)
+
+    with stats.stage('borders'):
+        set_tbl_borders(tbl)
+    if stats:
+        stats.count('tables')
+        stats.count('cells', tbl_rows * tbl_cols)
+        stats.count('merges', len(merges))
+        stats.count('borders', len(tbl._tbl.xpath('./w:tr/w:tc/w:tcPr/w:tcBorders/*')))
+    return tbl
+
+# ---------- 表格片段缓存 ----------
+_frag_cache = None
+
+def frag_cache():
+    """
+    本进程的表格片段缓存：表格指纹 → 表格 XML；内存层和磁盘层都关闭时为 None
+    设了 E2W_FRAG_CACHE_DIR 时片段也写到磁盘：命令行每次新起进程、批量和多工作表每次新建进程池，
+    修订版工作簿里没改动的表格照样能命中
+    """
+    global _frag_cache
+    if _frag_cache is None and (FRAG_CACHE_MB or FRAG_CACHE_DIR):
+        mb = 1024 * 1024
+        _frag_cache = ConvCache(int(FRAG_CACHE_MB * mb), FRAG_CACHE_DIR, int(FRAG_CACHE_DISK_MB * mb), ext='.xml')
+    return _frag_cache
+
+def tbl_fingerprint(block: TblBlock, merges, col_w: int, compact: bool) -> str:
+    """文本、对齐、合并、列宽、输出方式都相同的表格，生成的 XML 一定相同；与所在行号无关"""
+    h = hashlib.blake2b(repr((CACHE_VERSION, block.cols, len(block.rows), merges, col_w, compact)).encode(),
+                        digest_size=20)
+    for row in block.rows:
+        h.update('\x1f'.join([t + '\x1e' if is_right_aligned(v) else t for t, v in row]).encode())
+        h.update(b'\x1d')
+    return h.hexdigest()
+
+def tbl_fragment(block: TblBlock, index: MergeIndex, block_width: int, compact=False,
+                 stats: ConvStats = NO_STATS) -> str:
+    """
+    一个表格（含合并）的 XML；block_width 是版心宽度（EMU），按列均分
+    同一进程里转过的相同表格（修订版工作簿里没改动的区域）直接取片段缓存
+    """
+    from docx.shared import Emu
+    with stats.stage('merges'):
+        merges = tbl_merges(index, block)
+    with stats.stage('cells'):     # XML 写出方式下边框随单元格一起生成
+        col_w = Emu(block_width // block.cols).twips
+        cache = frag_cache()
+        key = cache and tbl_fingerprint(block, merges, col_w, compact)
+        cached = cache.get(key) if cache else None
+        if cached is None:
+            xml = tbl_xml(block, col_w, merges, compact=compact)
+            if cache:
+                cache.put(key, xml.encode())
+        else:
+            xml = cached.decode()
+    if stats:
+        stats.count('tables')
+        stats.count('cells', len(block.rows) * block.cols)
+        stats.count('merges', len(merges))
+        stats.count('borders', xml.count('w:color="000000"'))   # 每个边框元素恰有一个
+        if cache:
+            stats.count('frag_hits' if cached is not None else 'frag_misses')
+    return xml
+
+def tbl_slice_fragment(part: TblSlice, index: MergeIndex, block_width: int, compact=False,
+                       stats: ConvStats = NO_STATS) -> str:
+    """大表格一段的 XML（见 TblSlice），不经过片段缓存；各段拼起来与 tbl_fragment 整表生成的相同"""
+    from docx.shared import Emu
+    block = part.block
+    with stats.stage('merges'):
+        merges = tbl_merges(index, block)
+    with stats.stage('cells'):
+        xml = tbl_xml(block, Emu(block_width // block.cols).twips, merges, compact=compact,
+                      top=part.first, bottom=part.last)
+    if stats:
+        if part.first:
+            stats.count('tables')
+        stats.count('cells', len(block.rows) * block.cols)
+        stats.count('merges', len(merges))
+        stats.count('borders', xml.count('w:color="000000"'))
+    return xml
+
+# ---------- 单个工作表 → 正文 ----------
+def sheet_xml(ws, block_width: int, compact=False, stats: ConvStats = NO_STATS,
+              chunk_rows=0, reader='xml', rules: TblRules = DEFAULT_RULES,
+              skip=frozenset(), span=None, check=None, stream_rows=0, widths: dict = None) -> Iterator[str]:
+    """
+    按顺序产出一个工作表的正文 XML 片段（段落、表格），供直接插入 body
+    skip: 不输出的表格（按起始行号，即预览里的表格），分块的续表跟着原表一起去掉
+    span: 只生成工作表的这一段，见 split_sheet
+    check: 见 scan_sheet
+    stream_rows, widths: 见 scan_sheet；大表格分几段产出，单段不是完整的元素，只能按顺序拼接写出（流式写出用）
+    """
+    with stats.stage('load'):
+        merges = READERS[reader].merges(ws)
+        index = index_merges(merges)
+    for kind, item in stats.timed('scan', scan_sheet(ws, merges, chunk_rows, reader, rules, span, check,
+                                                     stream_rows, widths)):
+        if kind == 'tbl':
+            if (item.head or item.start) in skip:
+                continue
+            yield tbl_fragment(item, index, block_width, compact, stats)
+        elif kind == 'rows':
+            if item.origin in skip:
+                continue
+            yield tbl_slice_fragment(item, index, block_width, compact, stats)
+        else:
+            stats.count('paragraphs')
+            yield para_xml(item, compact)
+
+def add_sheet_docx(doc, ws, stats: ConvStats = NO_STATS, chunk_rows=0, reader='xml',
+                   rules: TblRules = DEFAULT_RULES, skip=frozenset(), check=None):
+    """原实现：逐段落、逐单元格调用 python-docx 写入一个工作表；check 见 scan_sheet"""
+    with stats.stage('load'):
+        merges = READERS[reader].merges(ws)
+        index = index_merges(merges)
+    for kind, item in stats.timed('scan', scan_sheet(ws, merges, chunk_rows, reader, rules, check=check)):
+        if kind == 'tbl':
+            if (item.head or item.start) in skip:
+                continue
+            add_tbl(doc, item, index, stats, check)
+        else:
+            stats.count('paragraphs')
+            with stats.stage('cells'):
+                p = doc.add_paragraph(item)
+                set_para_format(p)
+
+def pick_sheets(wb, sheets) -> List[int]:
+    """
+    sheets → 要转换的工作表序号（0-based）
+    None 第一个；'all' 全部；列表里可以是名称、序号（int，0-based）或数字字符串（1-based，界面输入用）
+    """
+    if sheets is None:
+        return [0]
+    if sheets == 'all':
+        return list(range(len(wb.worksheets)))
+    names = [ws.title for ws in wb.worksheets]
+    picked = []
+    for s in sheets:
+        if isinstance(s, int):
+            idx = s
+        elif s in names:
+            idx = names.index(s)
+        elif str(s).strip().isdigit():
+            idx = int(s) - 1
+        else:
+            idx = -1
+        if not 0 <= idx < len(names):
+            raise ValueError(f"找不到工作表：{s}")
+        if idx not in picked:
+            picked.append(idx)
+    return picked
+
+def sheet_fragment(job: Tuple[str, int, int, tuple], opts: dict, timeout: float = 0, trace_memory=False):
+    """
+    在工作进程里执行：(Excel 路径, 工作表序号, 版心宽度, 行段) → (成功, 错误, 正文 XML, 统计)
+    opts 带 spool（目录）时正文边生成边写进该目录下的临时文件，返回文件路径而不是 XML，见 parallel_sheets
+    """
+    src, sheet_idx, block_width, span = job
+    stats = ConvStats(trace_memory)
+    try:
+        with time_limit(timeout), stats.tracing():
+            with stats.stage('load'):
+                wb, reader = load_book(src, opts.get('reader', 'xml'))
+            try:
+                ws = wb.worksheets[sheet_idx]
+                fragments = sheet_xml(
+                    ws, block_width, opts.get('compact', False), stats, opts.get('chunk_rows', 0),
+                    reader, tbl_rules(opts.get('rules')),
+                    skipped(opts.get('skip'), sheet_idx), span, stream_rows=opts.get('stream_rows', 0),
+                    widths=opts.get('widths', {}).get(sheet_idx))
+                if opts.get('spool'):
+                    with tempfile.NamedTemporaryFile('wb', suffix='.xml', dir=opts['spool'], delete=False) as f:
+                        for x in fragments:
+                            f.write(bare_xml(x).encode())
+                    xml = f.name
+                else:
+                    xml = ''.join(bare_xml(x) for x in fragments)
+            finally:
+                wb.close()
+        return True, None, xml, stats.report()
+    except Exception as e:
+        return False, str(e), None, stats.report()
+
+def parallel_sheets(excel_file, titles: dict, block_width: int, compact: bool, workers: int,
+                    stats: ConvStats = NO_STATS, chunk_rows=0, reader='xml',
+                    rules: TblRules = DEFAULT_RULES, skip=None, parts=None,
+                    cancel: threading.Event = None, spool=False, widths: dict = None) -> Iterator:
+    """
+    多个工作表（或大工作表拆成的几段）交给进程池并行生成正文，按顺序产出各自的 XML（片段不带命名空间声明）
+    titles: {工作表序号: 名称}；内存里的文件先落到临时文件，各工作进程自己打开
+    parts: [(工作表序号, 行段), ...]，行段见 split_sheet；None 为 titles 里每个工作表整张一份
+    cancel: 置位后终止工作进程并抛 Cancelled
+    spool: 流式写出用：工作进程把正文（大表格按 STREAM_ROWS 分段生成）写进临时文件，
+           这里按顺序产出打开的文件（二进制，交给 stream_document 的 write 按块拷贝，读完即删）而不是字符串，
+           工作进程和主进程的内存都不随工作表大小增长
+    widths: {工作表序号: {表格首行: 列数}}，见 split_sheet；分段时工作进程不必各自再读一遍检测数组
+    """
+    src, tmp, spool_dir = excel_file, None, None
+    if not isinstance(src, (str, os.PathLike)):
+        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as f:
+            src.seek(0)
+            shutil.copyfileobj(src, f)
+        src = tmp = f.name
+    try:
+        opts = {'compact': compact, 'chunk_rows': chunk_rows, 'reader': reader,
+                'rules': rules._asdict(), 'skip': skip}
+        if spool:
+            spool_dir = tempfile.mkdtemp(prefix='e2w-')
+            opts.update(spool=spool_dir, stream_rows=STREAM_ROWS, widths=widths or {})
+        parts = parts or [(i, None) for i in titles]
+        jobs = [(src, i, block_width, span) for i, span in parts]
+        ready, nxt = {}, 0
+        for pos, success, error, xml, report in convert_in_pool(
+                jobs, opts, workers, 0,
+                func=sheet_fragment,
+                trace_memory=stats.trace_memory, cancel=cancel):
+            if not success:
+                raise RuntimeError(f"工作表「{titles[parts[pos][0]]}」：{error}")
+            for name, n in report['counts'].items():
+                stats.count(name, n)
+            ready[pos] = xml
+            while nxt in ready:
+                body = ready.pop(nxt)
+                nxt += 1
+                if not spool:
+                    yield body
+                    continue
+                with open(body, 'rb') as f:
+                    yield f
+                os.remove(body)
+        if cancel is not None and cancel.is_set():
+            raise Cancelled("转换已取消")
+    finally:
+        if tmp:
+            os.remove(tmp)
+        if spool_dir:
+            shutil.rmtree(spool_dir, ignore_errors=True)   # 出错、取消时剩下的片段文件
+
+def split_sheet(ws, workers: int, rules: TblRules = DEFAULT_RULES, reader='xml', widths: dict = None) -> list:
+    """
+    大工作表按表格边界拆成不超过 workers 段，返回各段 (首行, 末行)，最后一段末行为 None；
+    不拆时返回 [None]。每段（第一段除外）都从一个表格的首行开始，各段按单元格数大致均分。
+    工作表 XML 小于 SPLIT_MIN_MB 时不拆：开进程、各自打开文件的开销比省下的多
+    widths: 传入 dict 时顺便填上超过 STREAM_ROWS 行的表格的列数（见 tbl_widths），流式写出分段生成时用
+    """
+    if workers < 2 or not hasattr(ws, '_worksheet_path'):
+        return [None]
+    if ws.parent._archive.getinfo(ws._worksheet_path).file_size < SPLIT_MIN_MB * 1024 * 1024:
+        return [None]
+    masks = row_masks(ws, READERS[reader].merges(ws), reader)
+    tbls = detect_tbls(masks, rules)
+    if widths is not None:
+        widths.update(tbl_widths(masks, rules, STREAM_ROWS))
+    n = min(workers, len(tbls))
+    if n < 2:
+        return [None]
+    sizes = [(end - start + 1) * (max(masks.last[start - 1:end]) or 1) for start, end in tbls]
+    target, acc, cuts = sum(sizes) / n, 0, []
+    for (start, _), size in zip(tbls, sizes):
+        if acc >= target * (len(cuts) + 1) and len(cuts) < n - 1:
+            cuts.append(start)
+        acc += size
+    bounds = [1] + cuts
+    return [(lo, hi - 1) for lo, hi in zip(bounds, cuts)] + [(bounds[-1], None)]
+
+# ---------- 转换前预览 ----------
+# 各计数的大致成本：(秒, 输出字节)，按 xml / stream 写出方式在单核上实测拟合，只用于预估
+EST_COST = {'base': (0.03, 37_000), 'tables': (3e-3, 200), 'cells': (16e-6, 8.5),
+            'merges': (5e-5, 0), 'paragraphs': (2e-5, 40)}
+
+class TblPreview(NamedTuple):
+    start: int               # 起始行 1-based，也是 skip 里标识这个表格的行号
+    end: int                 # 结束行 1-based
+    cols: int                # 有效列数
+    merges: int              # 实际要做的合并数
+
+class SheetPreview(NamedTuple):
+    index: int               # 工作表序号 0-based
+    title: str
+    rows: int                # 工作表行数（含合并延伸出的行）
+    tbls: List[TblPreview]
+
+def preview_sheet(ws, rules: TblRules = DEFAULT_RULES, reader='xml') -> Tuple[int, List[TblPreview]]:
+    """只做检测：合并 → 逐行数组 → detect_tbls、有效列数、合并数；不取值、不生成 XML"""
+    merges = READERS[reader].merges(ws)
+    index = index_merges(merges)
+    masks = row_masks(ws, merges, reader)
+    tbls = []
+    for start, end in detect_tbls(masks, rules):
+        cols = max(masks.last[start - 1:end]) or 1       # 同 scan_sheet：表格行里最右的非空列
+        n = sum(1 for (_, c, _, w) in collect_merges(index, start, end) if c - 1 + w - 1 < cols)
+        tbls.append(TblPreview(start, end, cols, n))
+    return len(masks.cnt), tbls
+
+def preview_workbook(excel_file, sheets=None, rules=None, reader='xml') -> List[SheetPreview]:
+    """只读流式打开，对要转换的每个工作表做 preview_sheet；参数同 excel_to_word"""
+    rules = tbl_rules(rules)
+    wb, reader = load_book(excel_file, reader)
+    try:
+        out = []
+        for i in pick_sheets(wb, sheets):
+            ws = wb.worksheets[i]
+            rows, tbls = preview_sheet(ws, rules, reader)
+            out.append(SheetPreview(i, ws.title, rows, tbls))
+        return out
+    finally:
+        wb.close()
+
+def skipped(skip, sheet_idx: int) -> frozenset:
+    """skip（[[工作表序号, 表格起始行], ...]，可以 JSON 序列化）里属于这个工作表的起始行"""
+    return frozenset(row for i, row in skip or () if i == sheet_idx)
+
+def preview_counts(previews: List[SheetPreview], skip=None) -> dict:
+    """与 ConvStats 同名的计数：tables / cells / merges / paragraphs（去掉 skip 里的表格）"""
+    counts = dict.fromkeys(('tables', 'cells', 'merges', 'paragraphs'), 0)
+    for sp in previews:
+        off = skipped(skip, sp.index)
+        counts['paragraphs'] += sp.rows - sum(t.end - t.start + 1 for t in sp.tbls)
+        for t in sp.tbls:
+            if t.start in off:
+                continue
+            counts['tables'] += 1
+            counts['cells'] += (t.end - t.start + 1) * t.cols
+            counts['merges'] += t.merges
+    return counts
+
+def estimate(counts: dict) -> Tuple[float, int]:
+    """计数 → (预计耗时秒, 预计 .docx 字节数)"""
+    secs, size = EST_COST['base']
+    for name, n in counts.items():
+        t, b = EST_COST.get(name, (0, 0))
+        secs, size = secs + t * n, size + b * n
+    return secs, int(size)
+
+# ---------- 流式写出 document.xml ----------
+_DOC_PART = 'word/document.xml'
+
+def bare_xml(xml: str) -> str:
+    """去掉片段根元素上的 xmlns:w 声明，拼接、流式写出时由外层元素提供"""
+    return xml.replace(' ' + _W_NS, '', 1)
+
+def pop_body_xml(doc) -> str:
+    """
+    把 python-docx 加进正文的元素（末尾 sectPr 之前的全部）序列化后从文档树里取走；
+    整篇序列化再截取，子元素单独序列化会带上根元素的全部命名空间声明
+    """
+    from lxml import etree
+    body = doc.element.body
+    if len(body) < 2:
+        return ''
+    xml = etree.tostring(doc.element, encoding='unicode')
+    xml = xml[xml.index('<w:body>') + len('<w:body>'):xml.rindex('<w:sectPr')]
+    for el in body[:-1]:
+        body.remove(el)
+    return xml
+
+@contextmanager
+def stream_document(doc, doc_stream, zip64=False, stats: ConvStats = NO_STATS):
+    """
+    流式写出 .docx，产出 write(xml)：正文片段边生成边压缩进 word/document.xml，不进文档树，
+    内存与正文总长无关。其余部件按 python-docx 保存的结果原样拷贝，退出时补上 sectPr 和结束标签。
+    python-docx 直接加进文档的内容（标题、分节）用 write(pop_body_xml(doc)) 取出来写；
+    write 也接受 parallel_sheets(spool=True) 产出的片段文件，按块拷贝。
+    结果与插进文档树再 doc.save 的 document.xml 逐字节一致
+    zip64: document.xml 可能超过 4 GB 时打开
+    """
+    import zipfile
+    from docx.opc.oxml import serialize_part_xml
+
+    def split_body() -> Tuple[bytes, bytes]:
+        xml = serialize_part_xml(doc.element)
+        i = xml.index(b'<w:body>') + len(b'<w:body>')
+        return xml[:i], xml[i:]
+
+    with stats.stage('save'):
+        skeleton = io.BytesIO()
+        doc.save(skeleton)
+        zout = zipfile.ZipFile(doc_stream, 'w', zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(skeleton) as zin:
+            for info in zin.infolist():
+                if info.filename != _DOC_PART:
+                    zout.writestr(info, zin.read(info))
+        info = zipfile.ZipInfo(_DOC_PART, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        out = zout.open(info, 'w', force_zip64=zip64)
+        out.write(split_body()[0])
+    try:
+        out.write(pop_body_xml(doc).encode())
+
+        def write(xml):
+            if isinstance(xml, str):
+                out.write(bare_xml(xml).encode())
+            else:
+                shutil.copyfileobj(xml, out, 1 << 20)
+        yield write
+        out.write(pop_body_xml(doc).encode())
+        with stats.stage('save'):
+            out.write(split_body()[1])
+    finally:
+        out.close()
+        zout.close()
+
+# ---------- 转换函数 ----------
+class Cancelled(Exception):
+    """转换中途被取消（excel_to_word 的 cancel 已置位）"""
+
+def excel_to_word(excel_file, doc_stream, writer='xml', compact=False, sheets=None, workers=1,
+                  chunk_rows=0, reader='xml', rules=None, skip=None, stats: ConvStats = None,
+                  cancel: threading.Event = None):
+    """
+    转换单个Excel文件为Word文档
+    writer: 'xml' 直接生成表格 XML（默认，快）；'docx' 逐单元格调用 python-docx（原实现，便于对比）；
+            'stream' 同 'xml'，但正文边生成边写进压缩包，不建文档树，适合几十万行的大表；
+            超过 STREAM_ROWS 行的表格逐段生成写出（仍是一张表），单张大表的内存也不随行数增长
+    compact: 精简输出，格式统一放在文档样式里（对 'xml' / 'stream' 生效）
+    sheets: None 只转第一个工作表；'all' 或名称/序号列表见 pick_sheets，每个工作表单独一节、以表名作标题
+    workers: 并行的进程数（对 'xml' / 'stream' 生效）：多个工作表各交一个进程，大工作表（见 SPLIT_MIN_MB）
+             按表格边界拆成几段分给各进程，结果与顺序转换逐字节相同；批量转换的工作进程里保持 1
+    chunk_rows: 大于 0 时把超过这么多行的表格拆成几张表，续表重复原表首行作表头
+    reader: 'xml' 直接解析工作表 XML（默认，快）；'openpyxl' 经过 openpyxl 单元格对象（原实现，兜底）；
+            .xls（按文件头判断，与扩展名无关）总是用 xlrd 读取，忽略此项
+    rules: 表格判定规则，TblRules 或同名字段的 dict（如 {'min_rows': 2, 'gap': 1}），None 为默认规则
+    skip: 不输出的表格 [[工作表序号, 起始行], ...]，即 preview_workbook 里取消勾选的表格
+    stats: 传入 ConvStats 时记录各阶段耗时、计数和内存峰值
+    cancel: 后台任务的取消标记，每个工作表、每个表格之间及表格内每 1024 行检查一次，置位后返回 (False, "转换已取消")
+    """
+    from docx import Document
+    from docx.oxml import parse_xml
+
+    stats = stats or NO_STATS
+
+    def check():
+        if cancel is not None and cancel.is_set():
+            raise Cancelled("转换已取消")
+
+    try:
+        rules = tbl_rules(rules)
+        with stats.tracing():
+            # 只读模式流式读取，一次扫描完成检测与取值
+            with stats.stage('load'):
+                wb, reader = load_book(excel_file, reader)
+            try:
+                with stats.stage('load'):
+                    picked = pick_sheets(wb, sheets)
+                    doc = Document()
+                    anchor = doc.element.body.sectPr
+                    if compact:
+                        add_compact_styles(doc)
+                legacy = writer == 'docx' and not compact
+                stream = writer == 'stream'
+
+                # 多个工作表、或拆成几段的大工作表交给进程池；plan: {工作表序号: [行段, ...]}
+                bodies, plan, widths = None, {i: [None] for i in picked}, {i: {} for i in picked}
+                if not legacy and workers > 1:
+                    with stats.stage('scan'):
+                        plan = {i: split_sheet(wb.worksheets[i], workers, rules, reader, widths[i]) for i in picked}
+                    parts = [(i, span) for i in picked for span in plan[i]]
+                    if len(parts) > 1:
+                        titles = {i: wb.worksheets[i].title for i in picked}
+                        bodies = stats.timed('sheets', parallel_sheets(
+                            excel_file, titles, doc._block_width, compact, workers, stats, chunk_rows,
+                            reader, rules, skip, parts, cancel, spool=stream, widths=widths))
+
+                out = nullcontext()
+                if stream:
+                    # 粗估：document.xml 约为工作表 XML 的几十倍，可能超过 4 GB 时用 ZIP64
+                    archive = getattr(wb, '_archive', None)
+                    src_size = sum(f.file_size for f in archive.infolist()) if archive else 0
+                    out = stream_document(doc, doc_stream, src_size * 32 > (1 << 32), stats)
+                with out as write:
+                    for n, i in enumerate(picked):
+                        check()
+                        ws = wb.worksheets[i]
+                        if sheets is not None:           # 多工作表：每个一节，节首为表名
+                            if n:
+                                doc.add_section()
+                            doc.add_heading(ws.title, 1)
+                            if stream:
+                                write(pop_body_xml(doc))
+                        if legacy:
+                            add_sheet_docx(doc, ws, stats, chunk_rows, reader, rules, skipped(skip, i), check)
+                        elif bodies is not None:         # 并行生成好的整个工作表或其中各段
+                            for _ in plan[i]:
+                                check()
+                                body = next(bodies)
+                                with stats.stage('cells'):
+                                    if stream:
+                                        write(body)
+                                        continue
+                                    for el in parse_xml('<w:body %s>%s</w:body>' % (_W_NS, body)):
+                                        anchor.addprevious(el)
+                        else:
+                            for xml in sheet_xml(ws, doc._block_width, compact, stats, chunk_rows,
+                                                 reader, rules, skipped(skip, i), check=check,
+                                                 stream_rows=STREAM_ROWS if stream else 0):
+                                check()
+                                with stats.stage('cells'):
+                                    if stream:
+                                        write(xml)
+                                    else:
+                                        anchor.addprevious(parse_xml(xml))
+            finally:
+                wb.close()
+
+            if not stream:
+                with stats.stage('save'):
+                    doc.save(doc_stream)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+# ---------- 进程池批量转换 ----------
+@contextmanager
+def time_limit(timeout: float):
+    """用 SIGALRM 给当前进程的一次转换限时；没有 SIGALRM 的平台不限"""
+    alarm = timeout and hasattr(signal, 'SIGALRM')
+    if alarm:
+        def on_alarm(signum, frame):
+            raise TimeoutError(f"转换超时（超过 {timeout:g} 秒）")
+        signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+def convert_bytes(data: bytes, opts: dict, timeout: float = 0, trace_memory=False):
+    """在工作进程里执行：Excel 字节 → (成功, 错误, docx 字节, 统计)"""
+    stats = ConvStats(trace_memory)
+    with time_limit(timeout):
+        out = io.BytesIO()
+        success, error = excel_to_word(io.BytesIO(data), out, stats=stats, **opts)
+        return success, error, out.getvalue() if success else None, stats.report()
+
+def convert_file(paths: Tuple[str, str], opts: dict, timeout: float = 0, trace_memory=False,
+                 workers=1):
+    """在工作进程里执行：(Excel 路径, docx 路径) → (成功, 错误, None, 统计)，文件内容不经过进程间管道"""
+    src, dst = paths
+    stats = ConvStats(trace_memory)
+    with time_limit(timeout):
+        out = io.BytesIO()
+        success, error = excel_to_word(src, out, workers=workers, stats=stats, **opts)
+    if success:
+        os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        tmp = dst + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(out.getbuffer())
+        os.replace(tmp, dst)
+    return success, error, None, stats.report()
+
+def convert_in_pool(jobs: list, opts: dict, workers=MAX_WORKERS, timeout=FILE_TIMEOUT,
+                    func=convert_bytes, trace_memory=False, cancel: threading.Event = None,
+                    job_opts: dict = None):
+    """
+    多进程批量转换，按完成先后产出 (序号, 成功, 错误, docx 字节, 统计)
+    jobs 是每个文件交给 func 的第一个参数：convert_bytes 用 Excel 字节，convert_file 用路径对
+    - 在途任务数不超过进程数，提交时间即开始时间，超时按提交时间算
+    - 工作进程内用 SIGALRM 中断超时文件；没有 SIGALRM 的平台由这里兜底判超时：
+      超时的进程可能还卡着、占着名额，整个进程池终止，其余在途文件换新进程池重新计时
+    - 某个工作进程崩溃只让当时在途的文件失败，剩余文件换新进程池继续
+    - 调用方中途 close() 或 cancel 置位时终止在途的工作进程，不再产出（cancel 每秒检查一次）
+    job_opts: {序号: opts}，个别文件用自己的设置（如预览里去掉了部分表格），其余用 opts
+    """
+    n = max(1, min(workers, len(jobs)))
+    todo = list(enumerate(jobs))[::-1]
+    grace = 5
+    while todo:
+        pool = ProcessPoolExecutor(max_workers=n)
+        running, hung, broken = {}, False, False
+        try:
+            while todo or running:
+                while todo and len(running) < n:
+                    idx, job = todo.pop()
+                    fut = pool.submit(func, job, (job_opts or {}).get(idx, opts), timeout, trace_memory)
+                    running[fut] = (idx, time.monotonic() + timeout + grace if timeout else None)
+
+                done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    idx, _ = running.pop(fut)
+                    try:
+                        yield (idx,) + fut.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        yield idx, False, "工作进程异常退出", None, None
+                    except Exception as e:
+                        yield idx, False, str(e), None, None
+                if broken:
+                    for fut, (idx, _) in running.items():
+                        yield idx, False, "工作进程异常退出", None, None
+                    running = {}
+                    break
+
+                if cancel is not None and cancel.is_set():
+                    hung = bool(running)
+                    return
+
+                now = time.monotonic()
+                expired = [fut for fut, (_, deadline) in running.items() if deadline and now > deadline]
+                if expired:
+                    hung = True
+                    for fut in expired:
+                        idx, _ = running.pop(fut)
+                        yield idx, False, f"转换超时（超过 {timeout:g} 秒）", None, None
+                    # 没超时的在途文件放回去最先重做，不跟着卡住的进程一起失败
+                    todo.extend(sorted(((idx, jobs[idx]) for idx, _ in running.values()), reverse=True))
+                    running = {}
+                    break
+        except GeneratorExit:
+            hung = hung or bool(running)   # 调用方提前 close()（任务取消）：在途的转换不用等了
+            raise
+        finally:
+            if hung:
+                # 卡死或不再需要的工作进程不会自己结束，直接终止
+                for proc in list((pool._processes or {}).values()):
+                    proc.terminate()
+            pool.shutdown(wait=not hung, cancel_futures=True)
+
+# ---------- 转换结果缓存 ----------
+def cache_key(data: bytes, opts: dict) -> str:
+    """文件内容 + 转换选项 + 缓存版本 → sha256"""
+    h = hashlib.sha256(data)
+    h.update(json.dumps([CACHE_VERSION, opts], sort_keys=True).encode())
+    return h.hexdigest()
+
+class ConvCache:
+    """
+    按内容寻址的 docx 缓存：内存 LRU 一层 + 可选磁盘一层，各自按字节数上限淘汰
+    命中时直接返回 docx 字节，不再经过 openpyxl / python-docx
+    ext: 磁盘层的文件扩展名（表格片段缓存用 '.xml'）；磁盘层可以由多个进程共用，写不进去时只跳过不报错
+    """
+
+    def __init__(self, mem_bytes: int, disk_dir: str = '', disk_bytes: int = 0, ext: str = '.docx'):
+        self.mem_limit, self.disk_limit = mem_bytes, disk_bytes
+        self.disk_dir, self.ext = disk_dir, ext
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.mem_size = self.disk_size = 0
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk_size = sum(e.stat().st_size for e in os.scandir(disk_dir)
+                                 if e.name.endswith(ext))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + self.ext)
+
+    def get(self, key: str):
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+                self.stats['hits'] += 1
+                return data
+            if self.disk_dir:
+                try:
+                    with open(self._path(key), 'rb') as f:
+                        data = f.read()
+                    os.utime(self._path(key))       # 磁盘层按 mtime 做 LRU
+                except OSError:
+                    data = None
+                if data is not None:
+                    self.stats['hits'] += 1
+                    self.stats['disk_hits'] += 1
+                    self._put_mem(key, data)
+                    return data
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._put_mem(key, data)
+            if self.disk_dir and len(data) <= self.disk_limit and not os.path.exists(self._path(key)):
+                tmp = f"{self._path(key)}.{os.getpid()}.tmp"     # 共用目录的其他进程可能同时写同一个键
+                try:
+                    with open(tmp, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp, self._path(key))
+                except OSError:
+                    return
+                self.disk_size += len(data)
+                self._evict_disk()
+
+    def _put_mem(self, key: str, data: bytes):
+        if len(data) > self.mem_limit:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self.mem_size -= len(old)
+        self._mem[key] = data
+        self.mem_size += len(data)
+        while self.mem_size > self.mem_limit:
+            _, old = self._mem.popitem(last=False)
+            self.mem_size -= len(old)
+            self.stats['evictions'] += 1
+
+    def _evict_disk(self):
+        """超上限时按 mtime 从旧到新删到上限的九成，不用每次写入都扫一遍目录"""
+        if self.disk_size <= self.disk_limit:
+            return
+        try:
+            entries = sorted((e for e in os.scandir(self.disk_dir) if e.name.endswith(self.ext)),
+                             key=lambda e: e.stat().st_mtime)
+            self.disk_size = sum(e.stat().st_size for e in entries)   # 其他进程也在写，以目录为准
+        except OSError:         # 扫描途中文件被其他进程删掉，下次再淘汰
+            return
+        for e in entries:
+            if self.disk_size <= self.disk_limit * 0.9:
+                break
+            try:
+                size = e.stat().st_size
+                os.unlink(e.path)
+            except OSError:
+                continue
+            self.disk_size -= size
+            self.stats['evictions'] += 1
+
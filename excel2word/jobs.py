@@ -0,0 +1,137 @@
+"""
+后台转换任务队列：整个服务共用一个，全局并发上限，超出的按提交顺序排队
+页面只负责提交任务、轮询状态，转换不在 Streamlit 的脚本线程里跑，可以随时取消
+只用标准库，不依赖 streamlit
+"""
+from collections import deque
+from typing import Callable, Dict, Optional
+import itertools
+import os
+import threading
+import time
+
+JOB_LIMIT = int(os.environ.get('E2W_JOB_LIMIT', 2))            # 同时运行的任务数
+JOB_KEEP = float(os.environ.get('E2W_JOB_KEEP', 3600))         # 结束的任务没人来取，保留这么多秒
+
+# ---------- 单个任务 ----------
+class Job:
+    """
+    fn(job) 在队列线程里执行，返回值放进 result；执行中用 job.progress() 报进度，
+    并不时看 job.cancelled，为真时尽快结束。结束后 fn 置空，闭包里的上传内容随之释放
+    """
+
+    def __init__(self, job_id: str, fn: Callable, label: str = ''):
+        self.id, self.fn, self.label = job_id, fn, label
+        self.state = 'queued'          # queued / running / done / failed / cancelled
+        self.done, self.total, self.text = 0, 0, ''
+        self.result, self.error = None, None
+        self.submitted, self.started, self.finished = time.time(), None, None
+        self._cancel = threading.Event()
+
+    def progress(self, done: int, total: int, text: str = ''):
+        self.done, self.total, self.text = done, total, text
+
+    @property
+    def cancel_event(self) -> threading.Event:
+        return self._cancel
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def active(self) -> bool:
+        return self.state in ('queued', 'running')
+
+# ---------- 任务队列 ----------
+class JobQueue:
+    """
+    submit() 立即返回任务；同时运行的任务不超过 limit 个，每个任务一个线程，
+    运行中的任务数不到上限时才从排队里取下一个。任务本身用多少进程由 fn 决定
+    """
+
+    def __init__(self, limit: int = JOB_LIMIT, keep: float = JOB_KEEP):
+        self.limit, self.keep = max(1, limit), keep
+        self._jobs: Dict[str, Job] = {}
+        self._pending = deque()
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+
+    def submit(self, fn: Callable, label: str = '') -> Job:
+        with self._lock:
+            self._prune()
+            job = Job(f"{next(self._ids)}-{os.urandom(4).hex()}", fn, label)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self.stats['submitted'] += 1
+            self._start_next()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int:
+        """排队中的任务前面还有几个（0 表示下一个就轮到）"""
+        with self._lock:
+            return self._pending.index(job) if job in self._pending else 0
+
+    def cancel(self, job_id: str):
+        """排队中的直接取消；运行中的置取消标记，由任务自己停下。取消的任务结束即从队列删掉，不用再 forget"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.cancel_event.set()
+        with self._lock:
+            if job in self._pending:
+                self._pending.remove(job)
+                self._finish(job, 'cancelled')
+
+    def forget(self, job_id: str):
+        """取走结果之后从队列里删掉，不再占内存；运行中的任务不删"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.active:
+                del self._jobs[job_id]
+
+    def counts(self) -> dict:
+        with self._lock:
+            self._prune()
+            return {'running': self._running, 'queued': len(self._pending), 'limit': self.limit}
+
+    # 以下在持有 _lock 时调用
+    def _start_next(self):
+        while self._running < self.limit and self._pending:
+            job = self._pending.popleft()
+            job.state, job.started = 'running', time.time()
+            self._running += 1
+            threading.Thread(target=self._run, args=(job,), name=f'e2w-job-{job.id}', daemon=True).start()
+
+    def _finish(self, job: Job, state: str):
+        job.state, job.finished, job.fn = state, time.time(), None
+        self.stats[state] += 1
+        if state == 'cancelled':      # 会话已经不等这个任务了，结果也没人取
+            job.result = None
+            self._jobs.pop(job.id, None)
+
+    def _prune(self):
+        """清掉结束太久、没人来取的任务（会话已经关掉）"""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if not job.active and now - job.finished > self.keep:
+                del self._jobs[job_id]
+
+    def _run(self, job: Job):
+        try:
+            job.result = job.fn(job)
+            state = 'cancelled' if job.cancelled else 'done'
+        except Exception as e:
+            job.error = str(e)
+            state = 'cancelled' if job.cancelled else 'failed'
+        with self._lock:
+            self._running -= 1
+            self._finish(job, state)
+            self._start_next()
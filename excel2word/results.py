@@ -0,0 +1,131 @@
+"""
+转换结果暂存：所有会话共用，会话状态里只放取件号，结果本身放在这里统一管理内存
+- 单个结果超过 RESULT_SPILL_MB 写到临时文件；内存里的合计超过 RESULT_MEM_MB 时，最久没用的也挪到临时文件
+- 超过 RESULT_TTL 秒没人访问（会话已关掉）的结果丢掉；临时文件合计超过 RESULT_DISK_MB 按最久没用丢掉
+只用标准库，不依赖 streamlit
+"""
+from collections import OrderedDict
+from tempfile import SpooledTemporaryFile
+from typing import Optional
+import os
+import threading
+import time
+
+MB = 1024 * 1024
+RESULT_MEM_MB = float(os.environ.get('E2W_RESULT_MEM_MB', 256))      # 所有会话的结果合计放内存的上限
+RESULT_SPILL_MB = float(os.environ.get('E2W_RESULT_SPILL_MB', 16))   # 单个结果超过这么大直接写临时文件
+RESULT_DISK_MB = float(os.environ.get('E2W_RESULT_DISK_MB', 4096))   # 临时文件合计上限
+RESULT_TTL = float(os.environ.get('E2W_RESULT_TTL', 3600))           # 结果多久没人访问就丢掉（秒）
+RESULT_DIR = os.environ.get('E2W_RESULT_DIR') or None                # 临时文件目录，默认系统临时目录
+
+class ResultExpired(LookupError):
+    """取件号对应的结果已过期或已丢掉"""
+
+class ResultStore:
+    """
+    new_file() 给任务一个边写边溢出到磁盘的文件，写完 put() 换成取件号；
+    页面凭取件号 read()，下载按钮点击时才读出来
+    """
+
+    def __init__(self, mem_bytes: int = int(RESULT_MEM_MB * MB), spill_bytes: int = int(RESULT_SPILL_MB * MB),
+                 disk_bytes: int = int(RESULT_DISK_MB * MB), ttl: float = RESULT_TTL):
+        self.mem_limit, self.spill, self.disk_limit, self.ttl = mem_bytes, spill_bytes, disk_bytes, ttl
+        self._items = OrderedDict()      # 取件号 → [文件, 大小, 最近访问时刻]，最久没用的在前
+        self._lock = threading.Lock()
+        self.mem_size = self.disk_size = 0
+        self.stats = {'stored': 0, 'spilled': 0, 'expired': 0, 'evicted': 0}
+
+    def new_file(self) -> SpooledTemporaryFile:
+        return SpooledTemporaryFile(max_size=self.spill, dir=RESULT_DIR)
+
+    def put(self, data) -> str:
+        """bytes 或 new_file() 写好的文件 → 取件号"""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            f = self.new_file()
+            f.write(data)
+        else:
+            f = data
+        size = f.tell()
+        token = os.urandom(12).hex()
+        with self._lock:
+            self._items[token] = [f, size, time.time()]
+            self.stats['stored'] += 1
+            if f._rolled:
+                self.stats['spilled'] += 1
+                self.disk_size += size
+            else:
+                self.mem_size += size
+            self._prune()
+        return token
+
+    def touch(self, token: Optional[str]) -> bool:
+        """结果还在就刷新访问时刻；页面每次渲染下载按钮前调用"""
+        with self._lock:
+            self._prune()
+            item = self._items.get(token)
+            if item is None:
+                return False
+            item[2] = time.time()
+            self._items.move_to_end(token)
+            return True
+
+    def read(self, token: str) -> bytes:
+        """整个结果读出来交给下载；已经过期抛 ResultExpired，下载按钮报错而不是下载到一个空文件"""
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                raise ResultExpired("转换结果已过期，请重新转换")
+            item[2] = time.time()
+            self._items.move_to_end(token)
+            f = item[0]
+            f.seek(0)
+            return f.read()
+
+    def drop(self, token: Optional[str]):
+        """会话换了文件或重新转换，旧结果不再需要"""
+        with self._lock:
+            self._remove(token)
+
+    def usage(self) -> dict:
+        with self._lock:
+            self._prune()
+            return {'count': len(self._items), 'mem': self.mem_size, 'disk': self.disk_size,
+                    'mem_limit': self.mem_limit, 'disk_limit': self.disk_limit}
+
+    # 以下在持有 _lock 时调用
+    def _remove(self, token) -> bool:
+        item = self._items.pop(token, None)
+        if item is None:
+            return False
+        f, size, _ = item
+        if f._rolled:
+            self.disk_size -= size
+        else:
+            self.mem_size -= size
+        f.close()
+        return True
+
+    def _prune(self):
+        now = time.time()
+        for token, (_, _, used) in list(self._items.items()):
+            if now - used <= self.ttl:
+                break
+            self._remove(token)
+            self.stats['expired'] += 1
+        # 内存超预算：从最久没用的开始挪到临时文件，不丢结果
+        for f, size, _ in self._items.values():
+            if self.mem_size <= self.mem_limit:
+                break
+            if not f._rolled:
+                f.rollover()
+                self.mem_size -= size
+                self.disk_size += size
+                self.stats['spilled'] += 1
+        # 临时文件超上限：丢最久没用的落盘结果，刚放进来的那个保留
+        newest = next(reversed(self._items), None)
+        for token, (f, _, _) in list(self._items.items()):
+            if self.disk_size <= self.disk_limit:
+                break
+            if f._rolled and token != newest:
+                self._remove(token)
+                self.stats['evicted'] += 1
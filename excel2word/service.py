@@ -0,0 +1,362 @@
+"""
+本地 HTTP 转换服务：常驻一组预热好的工作进程（已导入 openpyxl / python-docx），
+其他系统直接 POST 工作簿字节拿回 .docx，不用每次付进程启动和导入的开销
+
+    python service.py --port 8765 --workers 4 --queue 16
+    curl --data-binary @月报.xlsx 'http://127.0.0.1:8765/convert?sheets=all' -o 月报.docx
+    curl --data-binary @报表.zip 'http://127.0.0.1:8765/convert?writer=stream' -o 结果.zip   # ZIP 里的多个工作簿 → ZIP
+    curl http://127.0.0.1:8765/healthz
+    curl http://127.0.0.1:8765/metrics
+
+选项放在查询串里，和 cli.py 同名：writer、reader、compact、sheets、chunk_rows、min_cells、min_rows、gap
+同时受理的请求不超过 工作进程数 + --queue，多出来的直接回 429（带 Retry-After），不在服务里无限堆积
+只用标准库，不依赖 streamlit
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import converter
+from cli import is_excel
+
+SERVICE_QUEUE = int(os.environ.get('E2W_SERVICE_QUEUE', 16))         # 工作进程都忙时最多再排队多少个请求
+SERVICE_MAX_MB = float(os.environ.get('E2W_SERVICE_MAX_MB', 100))    # 单个请求体上限（MB）
+LATENCY_WINDOW = 1000    # 延迟分位数按最近这么多个请求算
+RATE_WINDOW = 60         # 吞吐量按最近这么多秒算
+
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+log = logging.getLogger('excel2word')
+
+# ---------- 请求选项 ----------
+def query_opts(query: str) -> dict:
+    """查询串 → excel_to_word 的选项，取值不对时抛 ValueError"""
+    q = {k: v[-1] for k, v in parse_qs(query).items()}
+    opts = {'writer': q.get('writer', 'xml'), 'compact': q.get('compact', '') in ('1', 'true', 'yes')}
+    if opts['writer'] not in ('xml', 'docx', 'stream'):
+        raise ValueError(f"writer 只能是 xml / docx / stream：{opts['writer']}")
+    if q.get('reader', 'xml') != 'xml':
+        if q['reader'] != 'openpyxl':
+            raise ValueError(f"reader 只能是 xml / openpyxl：{q['reader']}")
+        opts['reader'] = q['reader']
+    if int(q.get('chunk_rows', 0)) > 0:
+        opts['chunk_rows'] = int(q['chunk_rows'])
+    rules = {f: int(q[f]) for f in ('min_cells', 'min_rows', 'gap') if f in q}
+    if rules:
+        converter.tbl_rules(rules)   # 不合理的规则在这里就回 400
+        opts['rules'] = rules
+    if q.get('sheets'):
+        opts['sheets'] = 'all' if q['sheets'] == 'all' else [s.strip() for s in q['sheets'].split(',') if s.strip()]
+    return opts
+
+def batch_members(data: bytes) -> list:
+    """
+    请求体是装着多个工作簿的 ZIP 时返回 [(成员路径, 字节), ...]；单个工作簿返回 []
+    .xlsx 本身也是 ZIP，按有没有 xl/workbook.xml 区分
+    """
+    if data[:4] != b'PK\x03\x04':
+        return []
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        names = zf.namelist()
+        if 'xl/workbook.xml' in names:
+            return []
+        members = [n for n in names if not n.endswith('/') and is_excel(n)]
+        if not members:
+            raise ValueError("ZIP 里没有 Excel 文件")
+        return [(n, zf.read(n)) for n in members]
+
+# ---------- 统计 ----------
+class Metrics:
+    """请求计数、在途数、吞吐量和延迟分位数；各处理线程共用，自带锁"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {'ok': 0, 'failed': 0, 'bad_request': 0, 'rejected': 0, 'files': 0}
+        self.in_flight = 0
+        self.latency = deque(maxlen=LATENCY_WINDOW)
+        self.finished = deque()   # 最近 RATE_WINDOW 秒内每个请求的完成时刻
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def reject(self, reason='rejected'):
+        """没受理的请求：rejected 为满了回 429，bad_request 为请求本身不对回 400"""
+        with self.lock:
+            self.counts[reason] += 1
+
+    def leave(self, result: str, seconds: float, files: int):
+        """result: ok / failed（转换失败）/ bad_request（选项或请求体不对）"""
+        now = time.time()
+        with self.lock:
+            self.in_flight -= 1
+            self.counts[result] += 1
+            self.counts['files'] += files
+            self.latency.append(seconds)
+            self.finished.append(now)
+
+    def snapshot(self, workers: int) -> dict:
+        now = time.time()
+        with self.lock:
+            while self.finished and self.finished[0] < now - RATE_WINDOW:
+                self.finished.popleft()
+            lat = sorted(self.latency)
+            window = min(RATE_WINDOW, max(now - self.started, 1e-3))
+            return {
+                'uptime': round(now - self.started, 1),
+                **self.counts,
+                'in_flight': self.in_flight,
+                'queued': max(0, self.in_flight - workers),
+                'throughput': round(len(self.finished) / window, 3),   # 每秒完成的请求数
+                'latency': {f'p{p}': round(lat[min(len(lat), math.ceil(p / 100 * len(lat))) - 1], 3)
+                            for p in (50, 90, 99)} if lat else {},
+            }
+
+# ---------- 工作进程池 ----------
+def warm_up():
+    """每个工作进程启动时执行一次：先把重量级依赖导入、默认模板读好，第一个请求不再付这份开销"""
+    import openpyxl  # noqa: F401
+    from docx import Document
+    Document()
+
+class Service:
+    """预热的进程池 + 受理名额；池子坏了（工作进程崩溃或卡死）就整个换新的，只是排队久了不换"""
+
+    def __init__(self, workers=converter.MAX_WORKERS, queue=SERVICE_QUEUE,
+                 timeout=converter.FILE_TIMEOUT, max_mb=SERVICE_MAX_MB):
+        self.workers, self.queue, self.timeout = workers, queue, timeout
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.metrics = Metrics()
+        self.lock = threading.Lock()
+        self.pool = self.start_pool()
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        wait([pool.submit(os.getpid) for _ in range(self.workers)])   # 把全部工作进程提前拉起来
+        return pool
+
+    def restart(self, pool: ProcessPoolExecutor):
+        """换掉坏掉的进程池；几个请求同时发现时只换一次"""
+        with self.lock:
+            if self.pool is not pool:
+                return
+            for proc in list((pool._processes or {}).values()):
+                proc.terminate()
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self.start_pool()
+            log.warning("工作进程池已重建")
+
+    def watch(self, pool: ProcessPoolExecutor, futs: list):
+        """
+        到期时已经在跑的转换可能只是排得晚，工作进程内的 SIGALRM 会在限时内收掉它；
+        再过一个限时还没结束才算卡死，换掉进程池
+        """
+        def check():
+            if not all(f.done() for f in futs):
+                log.warning("有转换超时后仍未结束，判定工作进程卡死")
+                self.restart(pool)
+        timer = threading.Timer(self.timeout + 5, check)
+        timer.daemon = True
+        timer.start()
+
+    def convert(self, items: list, opts: dict) -> list:
+        """[(名称, 工作簿字节), ...] → [(成功, 错误, docx 字节, 统计), ...]，同一请求的多个文件一起交给进程池"""
+        pool = self.pool
+        try:
+            futs = [pool.submit(converter.convert_bytes, data, opts, self.timeout) for _, data in items]
+        except BrokenProcessPool:
+            # 空闲时有工作进程退出了（被杀、内存不足），池子已经不能用：换新的再交
+            self.restart(pool)
+            pool = self.pool
+            futs = [pool.submit(converter.convert_bytes, data, opts, self.timeout) for _, data in items]
+        # 工作进程内有 SIGALRM 限时，这里再留余量兜底卡死的进程；排队时间按整个池子的轮次估
+        rounds = math.ceil((len(items) + self.queue) / self.workers) + 1
+        deadline = time.monotonic() + rounds * self.timeout + 5 if self.timeout else None
+        results, broken, late = [], False, []
+        for fut in futs:
+            try:
+                left = max(0, deadline - time.monotonic()) if deadline else None
+                results.append(fut.result(timeout=left))
+            except BrokenProcessPool:
+                broken = True
+                results.append((False, "工作进程异常退出", None, None))
+            except FutureTimeout:
+                # 还在排队的直接撤掉；已经在跑的先不动进程池，交给 watch 判断是不是卡死
+                if not fut.cancel():
+                    late.append(fut)
+                results.append((False, f"转换超时（超过 {self.timeout:g} 秒）", None, None))
+            except Exception as e:
+                results.append((False, str(e), None, None))
+        if broken:
+            self.restart(pool)
+        elif late:
+            self.watch(pool, late)
+        for (name, _), (ok, err, _, report) in zip(items, results):
+            converter.log_conversion(name, ok, report, error=err)
+        return results
+
+    def health(self) -> dict:
+        pool = self.pool
+        alive = sum(p.is_alive() for p in (pool._processes or {}).values())
+        return {'status': 'ok' if alive == self.workers else 'degraded',
+                'workers': self.workers, 'alive': alive, 'queue': self.queue}
+
+# ---------- HTTP ----------
+def pack_results(items: list, results: list) -> bytes:
+    """批量结果打成 ZIP：保持原来的目录结构，扩展名换成 .docx；失败的写进“转换失败.txt”"""
+    buf, used, failed = io.BytesIO(), set(), []
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for (name, _), (ok, err, docx, _) in zip(items, results):
+            if not ok:
+                failed.append(f"{name}: {err}")
+                continue
+            base = os.path.splitext(name)[0]
+            out, n = base + '.docx', 1
+            while out in used:   # a.xlsx 和 a.xls 同时存在
+                n += 1
+                out = f"{base} ({n}).docx"
+            used.add(out)
+            zf.writestr(out, docx)
+        if failed:
+            zf.writestr('转换失败.txt', '\n'.join(failed))
+    return buf.getvalue()
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'excel2word'
+    protocol_version = 'HTTP/1.1'
+    service: Service = None   # serve() 里设置
+
+    def log_message(self, fmt, *args):
+        log.debug("%s %s", self.address_string(), fmt % args)
+
+    def reply(self, code: int, body: bytes, ctype='application/json', **headers):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k.replace('_', '-'), v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, code: int, obj: dict, **headers):
+        self.reply(code, json.dumps(obj, ensure_ascii=False).encode(), **headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/healthz':
+            h = self.service.health()
+            self.reply_json(200 if h['status'] == 'ok' else 503, h)
+        elif path == '/metrics':
+            self.reply_json(200, self.service.metrics.snapshot(self.service.workers))
+        else:
+            self.reply_json(404, {'error': f"没有这个地址：{path}"})
+
+    def do_POST(self):
+        svc = self.service
+        url = urlsplit(self.path)
+        if url.path != '/convert':
+            self.close_connection = True
+            return self.reply_json(404, {'error': f"没有这个地址：{url.path}"})
+        try:
+            size = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.close_connection = True
+            return self.reply_json(411, {'error': "需要 Content-Length"})
+        if size < 0:
+            svc.metrics.reject('bad_request')
+            self.close_connection = True
+            return self.reply_json(400, {'error': f"Content-Length 不对：{size}"})
+        if size > svc.max_bytes:
+            self.close_connection = True
+            return self.reply_json(413, {'error': f"请求体超过 {svc.max_bytes / 1024 / 1024:g} MB"})
+        if not svc.slots.acquire(blocking=False):
+            # 满了就立刻拒绝，请求体不读，连接关掉
+            svc.metrics.reject()
+            self.close_connection = True
+            return self.reply_json(429, {'error': "转换服务繁忙，请稍后重试"}, Retry_After='1')
+
+        t0 = time.perf_counter()
+        svc.metrics.enter()
+        result, files = 'failed', 0
+        try:
+            data = self.rfile.read(size)
+            try:
+                opts = query_opts(url.query)
+                items = batch_members(data)
+            except (ValueError, zipfile.BadZipFile) as e:
+                result = 'bad_request'
+                return self.reply_json(400, {'error': str(e)})
+            batch = bool(items)
+            name = parse_qs(url.query).get('name', ['workbook.xlsx'])[-1]
+            items = items or [(name, data)]
+            files = len(items)
+            results = svc.convert(items, opts)
+            if batch:
+                ok = any(r[0] for r in results)
+                n_failed = sum(not r[0] for r in results)
+                result = 'ok' if ok else 'failed'
+                self.reply(200 if ok else 422, pack_results(items, results), 'application/zip',
+                           X_E2W_Failed=str(n_failed),
+                           Content_Disposition='attachment; filename="excel2word.zip"')
+            else:
+                ok, err, docx, _ = results[0]
+                if ok:
+                    result = 'ok'
+                    self.reply(200, docx, DOCX_TYPE,
+                               Content_Disposition='attachment; filename="converted.docx"')
+                else:
+                    self.reply_json(422, {'error': err})
+        finally:
+            svc.metrics.leave(result, time.perf_counter() - t0, files)
+            svc.slots.release()
+
+def serve(host='127.0.0.1', port=8765, **kw):
+    """启动服务并阻塞；Ctrl+C 退出时收掉工作进程"""
+    svc = Service(**kw)
+    Handler.service = svc
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    log.info("excel2word 服务：http://%s:%d  工作进程 %d，排队上限 %d",
+             host, httpd.server_address[1], svc.workers, svc.queue)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        svc.pool.shutdown(wait=False, cancel_futures=True)
+
+# ---------- 入口 ----------
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Excel → Word 本地转换服务")
+    ap.add_argument('--host', default='127.0.0.1', help="监听地址，默认只接受本机连接")
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('-w', '--workers', type=int, default=converter.MAX_WORKERS, help="常驻工作进程数，默认 CPU 核数")
+    ap.add_argument('--queue', type=int, default=SERVICE_QUEUE, help="工作进程都忙时最多排队的请求数，再多回 429")
+    ap.add_argument('--timeout', type=float, default=converter.FILE_TIMEOUT, help="单文件超时秒数，0 不限")
+    ap.add_argument('--max-mb', type=float, default=SERVICE_MAX_MB, help="单个请求体上限（MB），超过回 413")
+    ap.add_argument('-v', '--verbose', action='store_true', help="逐个请求输出访问日志")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(message)s', stream=sys.stderr)
+    serve(args.host, args.port, workers=max(1, args.workers), queue=max(0, args.queue),
+          timeout=args.timeout, max_mb=args.max_mb)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,293 +1,134 @@
 import streamlit as st
 from pathlib import Path
-import openpyxl
-from openpyxl.cell.cell import Cell, MergedCell
-from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
-from docx.oxml import OxmlElement
-from docx.oxml.shared import qn
-from docx.shared import Pt
-from typing import List, Tuple
-import warnings
+from functools import partial
 import datetime
 import io
 import zipfile
-import tempfile
 import os
 import time
-
-warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
-
-# ---------- 边框/非空判断 ----------
-def has_top_border(row: Tuple[Cell, ...]) -> bool:
-    return any(c.border.top and c.border.top.style for c in row)
-
-def non_empty_cnt(row: Tuple[Cell, ...]) -> int:
-    return sum(1 for c in row if c.value is not None)
-
-# ---------- 表格区域检测 ----------
-def find_tbls(ws) -> List[Tuple[int, int]]:
-    """
-    返回 [(start_row, end_row), ...] 1-based
-    规则：
-        1. 有上边框 → 必为表格行（非空单元格数不限）。
-        2. 无上边框 → 只有非空≥2 才当表格行。
-        3. 表格结束：遇到既无上边框、又非空<2 的行。
-    """
-    tbls, in_tbl, start = [], False, None
-    for idx, row in enumerate(ws.iter_rows(), 1):
-        top_border = has_top_border(row)
-        cnt = non_empty_cnt(row)
-
-        if not in_tbl:                    # 当前不在表内
-            if top_border or cnt >= 2:    # 有边框 或 无框但非空≥2
-                in_tbl, start = True, idx
-        else:                             # 已在表内
-            if not top_border and cnt < 2:  # 既无框又空 → 表结束
-                tbls.append((start, idx - 1))
-                in_tbl = False
-    if in_tbl:
-        tbls.append((start, ws.max_row))
-    return tbls
-
-# ---------- 计算有效列数 ----------
-def effective_cols(ws, start_row: int, end_row: int) -> int:
-    """返回当前表格区域里，最右一个非空单元格所在的列号（1-based）"""
-    max_col = 0
-    for r in range(start_row, end_row + 1):
-        row = list(ws.iter_rows(min_row=r, max_row=r))[0]
-        for c in range(len(row), 0, -1):          # 从右往左找
-            if row[c - 1].value is not None:
-                max_col = max(max_col, c)
-                break
-    return max_col or 1   # 至少留 1 列
-
-# ---------- Excel 单元格 → 字符串 ----------
-def fmt_value(cell: Cell) -> str:
-    """兼容 MergedCell 的取值/格式化"""
-    # 0. 空值
-    if cell.value is None:
-        return ""
-
-    # 1. 合并单元格只能拿到 value
-    if isinstance(cell, MergedCell):
-        v = cell.value
-    else:
-        v = cell.value   # 普通单元格
-
-    # 2. 普通单元格精细处理
-    if cell.data_type == 's':
-        return cell.value or ""
-    if cell.is_date:
-        return cell.value.strftime('%Y年%m月%d日')
-    if cell.data_type == 'n' and cell.value is not None:
-        nf = cell.number_format or ''
-        if '%' in nf:
-            return f"{cell.value:.2%}"
-        if ',' in nf or '#,#' in nf:
-            return f"{cell.value:,.2f}"
-        return f"{cell.value:.2f}"
-    return str(cell.value) if cell.value is not None else ""
-
-# ---------- 收集 Excel 合并单元格信息 ----------
-def collect_merges(ws, tbl_start: int, tbl_end: int):
-    """
-    返回 [(topRow, leftCol, height, width), ...]  1-based
-    只收集落在当前表格区域内的合并
-    """
-    rngs = []
-    for m in ws.merged_cells.ranges:
-        # m.min_row/max_row/min_col/max_col 都是 1-based
-        if m.min_row < tbl_start or m.max_row > tbl_end:
+import logging
+
+from converter import (DEFAULT_RULES, ConvCache, ConvStats, MAX_WORKERS, cache_key,
+                       convert_in_pool, estimate, excel_to_word, frag_cache, log_conversion,
+                       preview_counts, preview_workbook)
+from jobs import JOB_LIMIT, Job, JobQueue
+from results import ResultStore
+
+# 同时运行 JOB_LIMIT 个任务，进程数在任务之间平分，CPU 不会被超额瓜分
+JOB_WORKERS = max(1, MAX_WORKERS // JOB_LIMIT)
+
+# 每次转换一行 JSON 日志，输出到 stderr 供汇总
+log = logging.getLogger('excel2word')
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+# ---------- 转换缓存设置 ----------
+CACHE_MEM_MB = float(os.environ.get('E2W_CACHE_MEM_MB', 256))     # 内存层上限，0 关闭
+CACHE_DIR = os.environ.get('E2W_CACHE_DIR', '')                   # 磁盘层目录，留空关闭
+CACHE_DISK_MB = float(os.environ.get('E2W_CACHE_DISK_MB', 2048))  # 磁盘层上限
+
+@st.cache_resource
+def get_cache() -> ConvCache:
+    """所有会话共用一个缓存"""
+    mb = 1024 * 1024
+    return ConvCache(int(CACHE_MEM_MB * mb), CACHE_DIR, int(CACHE_DISK_MB * mb))
+
+@st.cache_resource
+def get_results() -> ResultStore:
+    """所有会话共用的结果暂存，会话状态里只放取件号，不放整个 docx / ZIP"""
+    return ResultStore()
+
+# ---------- ZIP 打包 ----------
+# .docx 本身已是 deflate 压缩过的 ZIP，再压一遍基本只耗 CPU，默认直接存储
+ZIP_MODES = {'store': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED}
+
+def unique_name(name: str, used: set) -> str:
+    """同名输出依次加 (2)、(3)…，ZIP 里不出现重复条目"""
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f"{stem} ({n}){ext}"
+    used.add(candidate)
+    return candidate
+
+def docx_name(excel_name: str) -> str:
+    return excel_name.replace('.xlsx', '.docx').replace('.xls', '.docx')
+
+# ---------- 性能统计展示 ----------
+STAGE_LABELS = {'load': '加载', 'scan': '检测/取值', 'sheets': '工作表(并行)', 'cells': '生成单元格',
+                'merges': '合并', 'borders': '边框', 'save': '保存'}
+COUNT_LABELS = {'tables': '表格', 'paragraphs': '段落', 'cells': '单元格', 'merges': '合并',
+                'borders': '边框元素', 'frag_hits': '表格片段命中', 'frag_misses': '表格重新生成'}
+
+def frag_hit_rate(reports) -> str:
+    """所有文件合计的表格片段缓存命中率"""
+    hits = sum(r['counts'].get('frag_hits', 0) for _, r in reports if r)
+    misses = sum(r['counts'].get('frag_misses', 0) for _, r in reports if r)
+    return f"{hits / (hits + misses):.0%}（{hits}/{hits + misses}）" if hits + misses else "—"
+
+def stats_rows(reports) -> list:
+    """[(文件名, 统计 或 None=缓存命中), ...] → 表格行"""
+    rows = []
+    for name, report in reports:
+        row = {'文件': name}
+        if report is None:
+            row['总耗时(秒)'] = '缓存命中'
+        else:
+            row['总耗时(秒)'] = f"{report['seconds']:.3f}"
+            for key, label in STAGE_LABELS.items():
+                row[label + '(秒)'] = f"{report['stages'].get(key, 0):.3f}"
+            for key, label in COUNT_LABELS.items():
+                row[label] = report['counts'].get(key, 0)
+            if 'peak_mb' in report:
+                row['内存峰值(MB)'] = report['peak_mb']
+        rows.append(row)
+    return rows
+
+# ---------- 转换前预览 ----------
+def preview_files(uploaded_files, opts) -> list:
+    """每个上传文件只做表格检测，[(文件名, [SheetPreview, ...] 或 None, 错误), ...]"""
+    out = []
+    for f in uploaded_files:
+        try:
+            sheets = preview_workbook(io.BytesIO(f.getvalue()), opts.get('sheets'),
+                                      opts.get('rules'), opts.get('reader', 'xml'))
+            out.append((f.name, sheets, None))
+        except Exception as e:
+            out.append((f.name, None, str(e)))
+    return out
+
+def preview_panel():
+    """列出检测到的表格，可取消勾选；取消的表格记到 session_state.skips，转换时不输出"""
+    skips, secs, size, tbls, cells = {}, 0.0, 0, 0, 0
+    for i, (name, sheets, error) in enumerate(st.session_state.preview):
+        if error:
+            st.error(f"**{name}**: {error}")
             continue
-        rngs.append((m.min_row, m.min_col,
-                     m.max_row - m.min_row + 1,
-                     m.max_col - m.min_col + 1))
-    return rngs
-
-# ---------- 段落样式 ----------
-def set_para_format(p):
-    # 段落设置
-    pf = p.paragraph_format
-    pf.space_before = Pt(6)
-    pf.space_after = Pt(6)
-    pf.line_spacing_rule = WD_LINE_SPACING.EXACTLY
-    pf.line_spacing = Pt(18)
-    pf.alignment = WD_ALIGN_PARAGRAPH.LEFT
-
-    # 字体字号设置
-    run = p.runs[0] if p.runs else p.add_run()
-    run.font.size = Pt(10.5)
-    rPr = run._element.get_or_add_rPr()
-    rFonts = rPr.get_or_add_rFonts()
-    rFonts.set(qn('w:ascii'), 'Times New Roman')
-    rFonts.set(qn('w:hAnsi'), 'Times New Roman')
-    rFonts.set(qn('w:eastAsia'), '宋体')
-
-# ---------- Word 表格样式 ----------
-def set_cell_format(cell, text, cell_value):
-    cell.text = text
-    
-    # 垂直居中
-    tc_pr = cell._tc.get_or_add_tcPr()
-    tcVAlign = OxmlElement('w:vAlign')
-    tcVAlign.set(qn('w:val'), 'center')
-    tc_pr.append(tcVAlign)
-
-    # 表格段落设置
-    p = cell.paragraphs[0]
-    p_format = p.paragraph_format
-    p_format.space_before = Pt(5)
-    p_format.space_after  = Pt(5)
-    p_format.line_spacing_rule = WD_LINE_SPACING.EXACTLY
-    p_format.line_spacing = Pt(12)
-
-    # 表格字体字号设置
-    run = p.runs[0] if p.runs else p.add_run()
-    run.font.size = Pt(10.5)
-    rPr = run._element.get_or_add_rPr()
-    rFonts = rPr.get_or_add_rFonts()
-    rFonts.set(qn('w:ascii'), 'Times New Roman')
-    rFonts.set(qn('w:hAnsi'), 'Times New Roman')
-    rFonts.set(qn('w:eastAsia'), '宋体')
-
-    # 根据单元格值类型设置对齐方式
-    if isinstance(cell_value, (int, float)) and not isinstance(cell_value, bool):
-        p_format.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    else:
-        p_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
-
-# ---------- Word 表格边框 ----------
-def set_tbl_borders(tbl, thick=12, dash=6):
-    rows = tbl.rows 
-    if not rows:
-        return
-
-    # 横向边框
-    for cell in rows[0].cells:                 
-        tc_pr = cell._tc.get_or_add_tcPr()     
-        tc_borders = tc_pr.first_child_found_in('w:tcBorders') 
-        if tc_borders is None:                  
-            tc_borders = OxmlElement('w:tcBorders')  
-            tc_pr.append(tc_borders)           
-        top = OxmlElement('w:top')              
-        top.set(qn('w:val'), 'single')
-        top.set(qn('w:sz'), str(thick))
-        top.set(qn('w:color'), '000000')
-        tc_borders.append(top)
-
-        btm = OxmlElement('w:bottom')
-        btm.set(qn('w:val'), 'dotted')
-        btm.set(qn('w:sz'), str(dash))
-        btm.set(qn('w:color'), '000000')
-        tc_borders.append(btm)
-        
-    for row in rows[1:-1]:
-        for cell in row.cells:
-            tc_pr = cell._tc.get_or_add_tcPr()
-            tc_borders = tc_pr.first_child_found_in('w:tcBorders')
-            if tc_borders is None:
-                tc_borders = OxmlElement('w:tcBorders')
-                tc_pr.append(tc_borders)
-            btm = OxmlElement('w:bottom')
-            btm.set(qn('w:val'), 'dotted')
-            btm.set(qn('w:sz'), str(dash))
-            btm.set(qn('w:color'), '000000')
-            tc_borders.append(btm)
-
-    for cell in rows[-1].cells:
-        tc_pr = cell._tc.get_or_add_tcPr()
-        tc_borders = tc_pr.first_child_found_in('w:tcBorders')
-        if tc_borders is None:
-            tc_borders = OxmlElement('w:tcBorders')
-            tc_pr.append(tc_borders)
-        btm = OxmlElement('w:bottom')
-        btm.set(qn('w:val'), 'single')
-        btm.set(qn('w:sz'), str(thick))
-        btm.set(qn('w:color'), '000000')
-        tc_borders.append(btm)
-
-    # 竖向边框
-    for row in rows:
-        for idx, cell in enumerate(row.cells):
-            tc_pr = cell._tc.get_or_add_tcPr()
-            tc_borders = tc_pr.first_child_found_in('w:tcBorders')
-            if tc_borders is None:
-                tc_borders = OxmlElement('w:tcBorders')
-                tc_pr.append(tc_borders)
-
-            if idx != len(row.cells) - 1:
-                right = OxmlElement('w:right')
-                right.set(qn('w:val'), 'dotted')
-                right.set(qn('w:sz'), str(dash))
-                right.set(qn('w:color'), '000000')
-                tc_borders.append(right)
-
-# ---------- 转换函数 ----------
-def excel_to_word(excel_file, doc_stream):
-    """转换单个Excel文件为Word文档"""
-    try:
-        wb = openpyxl.load_workbook(excel_file, data_only=True)
-        ws = wb.worksheets[0]
-        doc = Document()
-
-        tbl_ranges = find_tbls(ws)
-        tbl_idx = 0
-        row_idx = 1
-
-        while row_idx <= ws.max_row:
-            if tbl_idx < len(tbl_ranges) and row_idx == tbl_ranges[tbl_idx][0]:
-                tbl_start, tbl_end = tbl_ranges[tbl_idx]
-
-                tbl_rows = tbl_end - tbl_start + 1
-                tbl_cols = effective_cols(ws, tbl_start, tbl_end)
-                tbl = doc.add_table(rows=tbl_rows, cols=tbl_cols)
-
-                for r_offset in range(tbl_rows):
-                    src_row = list(ws.iter_rows(min_row=tbl_start + r_offset,
-                                                max_row=tbl_start + r_offset,
-                                                values_only=False))[0]
-                    dest_cells = tbl.rows[r_offset].cells
-                    for c_idx in range(tbl_cols):
-                        cell_value = src_row[c_idx].value
-                        cell_text = fmt_value(src_row[c_idx])
-                        set_cell_format(dest_cells[c_idx], cell_text, cell_value)
-
-                for (r, c, h, w) in collect_merges(ws, tbl_start, tbl_end):
-                    if c - 1 + w - 1 < tbl_cols:
-                        top_left = tbl.cell(r - tbl_start, c - 1)
-                        btm_right = tbl.cell(r - tbl_start + h - 1, c - 1 + w - 1)
-                        top_left.merge(btm_right)
-
-                set_tbl_borders(tbl)
-                row_idx = tbl_end + 1
-                tbl_idx += 1
+        old = st.session_state.skips.get(i, [])
+        rows = [{'转换': [sp.index, t.start] not in old, '工作表': sp.title, '起始行': t.start,
+                 '结束行': t.end, '行数': t.end - t.start + 1, '列数': t.cols, '合并': t.merges,
+                 'sheet': sp.index}
+                for sp in sheets for t in sp.tbls]
+        with st.expander(f"🔍 {name}：{len(rows)} 个表格", expanded=len(st.session_state.preview) == 1):
+            if not rows:
+                st.caption("没有检测到表格，只输出段落")
                 continue
-
-            txt = ' '.join(fmt_value(c) for c in ws[row_idx]).strip()
-            p = doc.add_paragraph(txt)
-            set_para_format(p)
-            row_idx += 1
-
-        doc.save(doc_stream)
-        return True, None
-    except Exception as e:
-        return False, str(e)
-
-# ---------- 创建ZIP字节 ----------
-def create_zip_bytes(folder_path):
-    """创建ZIP文件并返回bytes"""
-    zip_buffer = io.BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                rel_path = os.path.relpath(file_path, folder_path)
-                zip_file.write(file_path, rel_path)
-    
-    zip_buffer.seek(0)
-    return zip_buffer
+            edited = st.data_editor(rows, key=f"preview_{i}", hide_index=True,
+                                    column_order=['转换', '工作表', '起始行', '结束行', '行数', '列数', '合并'],
+                                    disabled=['工作表', '起始行', '结束行', '行数', '列数', '合并'])
+        skips[i] = [[r['sheet'], r['起始行']] for r in edited if not r['转换']]
+        counts = preview_counts(sheets, skips[i])
+        t, b = estimate(counts)
+        secs, size = secs + t, size + b
+        tbls, cells = tbls + counts['tables'], cells + counts['cells']
+    st.session_state.skips = skips
+    st.caption(f"将转换 {tbls} 个表格、{cells:,} 个单元格，预计耗时约 {secs:.1f} 秒，"
+               f"输出约 {size / 1024 / 1024:.1f} MB（不含排队）")
 
 # ---------- Streamlit 界面 ----------
 def main():
@@ -300,8 +141,8 @@ def main():
     # 初始化会话状态
     if 'converted' not in st.session_state:
         st.session_state.converted = False
-    if 'download_data' not in st.session_state:
-        st.session_state.download_data = None
+    if 'download_token' not in st.session_state:
+        st.session_state.download_token = None
     if 'download_filename' not in st.session_state:
         st.session_state.download_filename = None
     if 'success_count' not in st.session_state:
@@ -316,6 +157,16 @@ def main():
         st.session_state.prev_uploaded_files = None
     if 'download_clicked' not in st.session_state:
         st.session_state.download_clicked = False
+    if 'prev_opts' not in st.session_state:
+        st.session_state.prev_opts = None
+    if 'reports' not in st.session_state:
+        st.session_state.reports = []
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None
+    if 'preview' not in st.session_state:
+        st.session_state.preview = None
+    if 'skips' not in st.session_state:
+        st.session_state.skips = {}
     
     st.title("📊 Excel2Word")
     
@@ -329,14 +180,27 @@ def main():
     if uploaded_files:
         file_count = len(uploaded_files)
         
-        # 如果上传了新文件，重置转换状态
+        # 如果上传了新文件或改了转换设置，重置转换状态
         current_files = [f.name for f in uploaded_files]
         prev_files = st.session_state.prev_uploaded_files or []
+        opts = conv_options()
         
-        if current_files != prev_files:
+        if current_files != prev_files or opts != st.session_state.prev_opts:
+            cancel_conversion()      # 换了文件或设置，之前提交的任务不再需要
+            drop_result()
             st.session_state.converted = False
             st.session_state.download_clicked = False
             st.session_state.prev_uploaded_files = current_files
+            st.session_state.prev_opts = opts
+            st.session_state.preview = None     # 检测结果与文件、设置有关，重新预览
+            st.session_state.skips = {}
+        
+        # 结果太久没下载已被清掉（或被挤出暂存）：回到转换前的状态
+        if (st.session_state.converted and st.session_state.download_token
+                and not get_results().touch(st.session_state.download_token)):
+            st.session_state.converted = False
+            st.session_state.download_token = None
+            st.warning("转换结果已过期，请重新转换")
         
         # 显示文件信息（包含转换结果）
         if st.session_state.converted:
@@ -350,7 +214,13 @@ def main():
         st.info(status_text)
         
         # 主按钮区域
-        if not st.session_state.converted:
+        if st.session_state.job_id:
+            # 后台转换中：轮询进度，可取消
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col2:
+                job_panel()
+        
+        elif not st.session_state.converted:
             # 显示转换按钮
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
@@ -359,18 +229,17 @@ def main():
                     st.session_state.success_count = 0
                     st.session_state.failed_count = 0
                     st.session_state.failed_files = []
+                    st.session_state.reports = []
                     st.session_state.download_clicked = False
-                    
-                    if file_count == 1:
-                        # 单文件处理
-                        st.session_state.is_batch = False
-                        with st.spinner("正在转换中..."):
-                            process_single_file(uploaded_files[0])
-                    else:
-                        # 多文件处理
-                        st.session_state.is_batch = True
-                        with st.spinner("正在批量转换中..."):
-                            process_multiple_files(uploaded_files)
+                    drop_result()
+                    submit_conversion(uploaded_files, opts)
+                    st.rerun()
+                if st.button("🔍 预览表格", use_container_width=True,
+                             help="只检测表格区域，几秒内列出各表格的大小、合并数和预计耗时，可去掉不需要的表格"):
+                    with st.spinner("正在检测表格..."):
+                        st.session_state.preview = preview_files(uploaded_files, opts)
+            if st.session_state.preview:
+                preview_panel()
         
         else:
             # 显示下载区域
@@ -399,10 +268,10 @@ def main():
                     button_type = "primary"
                     button_key = "download_file"
                     
-                    # 使用download_button（蓝色按钮）
+                    # 使用download_button（蓝色按钮）；点击时才从暂存里读出结果，页面渲染不占内存
                     if st.download_button(
                         label=button_label,
-                        data=st.session_state.download_data,
+                        data=partial(get_results().read, st.session_state.download_token),
                         file_name=st.session_state.download_filename,
                         mime="application/zip" if st.session_state.is_batch else "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
                         type=button_type,
@@ -418,104 +287,215 @@ def main():
                 with st.expander(f"📛 转换失败的文件 ({st.session_state.failed_count}个)", expanded=False):
                     for file_name, error in st.session_state.failed_files:
                         st.error(f"**{file_name}**: {error}")
-
-def process_single_file(uploaded_file):
-    """单文件处理"""
-    try:
-        # 创建临时文件进行转换
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp_file:
-            success, error = excel_to_word(uploaded_file, tmp_file.name)
             
+            # 各文件的分阶段耗时、计数
+            if st.session_state.reports:
+                with st.expander("⏱️ 转换统计", expanded=False):
+                    st.dataframe(stats_rows(st.session_state.reports), hide_index=True)
+                    st.caption(f"表格片段缓存命中率：{frag_hit_rate(st.session_state.reports)}")
+
+SHEET_MODES = {'first': "第一个", 'all': "全部", 'pick': "指定"}
+RULE_INPUTS = {f: getattr(DEFAULT_RULES, f) for f in ('min_cells', 'min_rows', 'gap')}
+
+def conv_options():
+    """侧边栏里的转换设置 → excel_to_word 的关键字参数"""
+    opts = {'compact': st.session_state.get('compact', False)}
+    if st.session_state.get('stream', True):
+        opts['writer'] = 'stream'
+    if st.session_state.get('chunk_rows'):
+        opts['chunk_rows'] = int(st.session_state.chunk_rows)
+    # 表格识别规则只带与默认不同的项，默认设置下缓存键不变
+    rules = {f: int(st.session_state.get('rule_' + f, d)) for f, d in RULE_INPUTS.items()}
+    rules = {f: v for f, v in rules.items() if v != getattr(DEFAULT_RULES, f)}
+    if rules:
+        opts['rules'] = rules
+    mode = st.session_state.get('sheet_mode', 'first')
+    if mode == 'all':
+        opts['sheets'] = 'all'
+    elif mode == 'pick':
+        names = [s.strip() for s in st.session_state.get('sheet_names', '').replace('，', ',').split(',')]
+        opts['sheets'] = [s for s in names if s] or None
+    return opts
+
+def process_single_file(name: str, data: bytes, opts, cache: ConvCache, store: ResultStore,
+                        trace_memory=False, job: Job = None) -> dict:
+    """单文件处理，在后台任务线程里执行，返回要写进会话状态的结果（docx 放进 store，只返回取件号）"""
+    result = {'is_batch': False, 'success_count': 0, 'failed_count': 0, 'failed_files': []}
+    try:
+        key = cache_key(data, opts)
+        doc_bytes = cache.get(key)
+        success, error, report = True, None, None
+        
+        if doc_bytes is None:
+            # 直接保存到内存，不经过临时文件
+            doc_stream = io.BytesIO()
+            stats = ConvStats(trace_memory)
+            success, error = excel_to_word(io.BytesIO(data), doc_stream, workers=JOB_WORKERS,
+                                           stats=stats, cancel=job and job.cancel_event, **opts)
+            report = stats.report()
             if success:
-                with open(tmp_file.name, 'rb') as f:
-                    doc_bytes = f.read()
-                
-                # 保存到会话状态
-                st.session_state.download_data = doc_bytes
-                st.session_state.download_filename = uploaded_file.name.replace('.xlsx', '.docx').replace('.xls', '.docx')
-                st.session_state.success_count = 1
-                st.session_state.converted = True
-            else:
-                st.session_state.failed_count = 1
-                st.session_state.failed_files = [(uploaded_file.name, error)]
-                st.session_state.converted = True
-            
-            # 清理临时文件
-            os.unlink(tmp_file.name)
+                doc_bytes = doc_stream.getvalue()
+                cache.put(key, doc_bytes)
+        log_conversion(name, success, report, cached=report is None, error=error)
+        result['reports'] = [(name, report)]
+        
+        if success:
+            result['download_token'] = store.put(doc_bytes)
+            result['download_filename'] = docx_name(name)
+            result['success_count'] = 1
+        else:
+            result['failed_count'] = 1
+            result['failed_files'] = [(name, error)]
             
     except Exception as e:
-        st.session_state.failed_count = 1
-        st.session_state.failed_files = [(uploaded_file.name, str(e))]
-        st.session_state.converted = True
+        result['failed_count'] = 1
+        result['failed_files'] = [(name, str(e))]
+    return result
 
-def process_multiple_files(uploaded_files):
-    """多文件处理"""
-    # 创建临时文件夹
-    with tempfile.TemporaryDirectory() as temp_dir:
-        output_folder = os.path.join(temp_dir, "转换结果")
-        os.makedirs(output_folder)
-        
-        success_count = 0
-        failed_files = []
-        
-        # 显示进度条
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+def process_multiple_files(files, opts, cache: ConvCache, store: ResultStore, zip_mode='store',
+                           trace_memory=False, job: Job = None, file_opts: dict = None) -> dict:
+    """
+    多文件处理，在后台任务线程里执行：每个结果一出来就按上传顺序写进 ZIP，
+    ZIP 直接写在 store 的暂存文件里，超过阈值自动落到磁盘
+    files: [(文件名, 内容), ...]；进度通过 job.progress 报给页面
+    file_opts: {序号: opts}，个别文件用自己的设置（预览里去掉了部分表格）
+    """
+    file_opts = file_opts or {}
+    total = len(files)
+    success_count = 0
+    failed = {}
+    progress = job.progress if job is not None else (lambda done, total, text='': None)
+    progress(0, total, f"正在处理 {total} 个文件（{min(JOB_WORKERS, total)} 个进程并行）")
+    
+    # 先查缓存，只有未命中的文件进进程池
+    results, keys, todo, reports = {}, {}, [], {}
+    for idx, (name, data) in enumerate(files):
+        keys[idx] = cache_key(data, file_opts.get(idx, opts))
+        doc_bytes = cache.get(keys[idx])
+        if doc_bytes is None:
+            todo.append((idx, data))
+        else:
+            results[idx] = doc_bytes
+            reports[idx] = None
+            log_conversion(name, True, cached=True)
+    done = len(results)
+    progress(done, total, f"正在处理 {total} 个文件（{min(JOB_WORKERS, total)} 个进程并行）")
+    
+    zip_buffer = store.new_file()
+    with zipfile.ZipFile(zip_buffer, 'w', ZIP_MODES[zip_mode]) as zip_file:
+        next_idx, used = 0, set()
         
-        for idx, uploaded_file in enumerate(uploaded_files):
-            progress = (idx + 1) / len(uploaded_files)
-            progress_bar.progress(progress)
-            status_text.text(f"正在处理文件 {idx + 1}/{len(uploaded_files)}: {uploaded_file.name}")
-            
-            try:
-                # 生成输出文件名
-                doc_filename = uploaded_file.name.replace('.xlsx', '.docx').replace('.xls', '.docx')
-                output_path = os.path.join(output_folder, doc_filename)
-                
-                # 转换文件
-                success, error = excel_to_word(uploaded_file, output_path)
-                
-                if success:
+        def flush():
+            """按上传顺序写出已就绪的结果，ZIP 内容与完成先后无关"""
+            nonlocal next_idx, success_count
+            while next_idx < total and (next_idx in results or next_idx in failed):
+                doc_bytes = results.pop(next_idx, None)
+                if doc_bytes is not None:
+                    name = unique_name(docx_name(files[next_idx][0]), used)
+                    zip_file.writestr(name, doc_bytes)
                     success_count += 1
-                else:
-                    failed_files.append((uploaded_file.name, error))
-                    
-            except Exception as e:
-                failed_files.append((uploaded_file.name, str(e)))
+                next_idx += 1
         
-        # 清理进度条
-        progress_bar.empty()
-        status_text.empty()
+        flush()
+        pool_results = convert_in_pool([data for _, data in todo], opts, JOB_WORKERS,
+                                       trace_memory=trace_memory,
+                                       cancel=job and job.cancel_event,
+                                       job_opts={pos: file_opts[idx] for pos, (idx, _) in enumerate(todo)
+                                                 if idx in file_opts}) if todo else ()
+        for pos, success, error, doc_bytes, report in pool_results:
+            idx = todo[pos][0]
+            name = files[idx][0]
+            reports[idx] = report
+            log_conversion(name, success, report, cached=False, error=error)
+            done += 1
+            progress(done, total, f"已完成 {done}/{total}: {name}")
+            if success:
+                results[idx] = doc_bytes
+                cache.put(keys[idx], doc_bytes)
+            else:
+                failed[idx] = (name, error)
+            flush()
         
-        # 保存结果到会话状态
-        if success_count > 0:
-            # 创建ZIP文件
-            zip_buffer = create_zip_bytes(output_folder)
-            
-            # 保存到会话状态
-            st.session_state.download_data = zip_buffer.getvalue()
-            st.session_state.download_filename = f"Excel转Word_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-            st.session_state.success_count = success_count
-            st.session_state.failed_count = len(failed_files)
-            st.session_state.failed_files = failed_files
-            st.session_state.converted = True
+        if success_count == 0:
+            # 即使全部失败也给一个说明文件
+            zip_file.writestr("转换说明.txt", "所有文件转换失败，请查看失败详情。".encode())
+    
+    if job is not None and job.cancelled:
+        # 任务已取消，结果没人取：暂存文件直接关掉，不放进 store
+        zip_buffer.close()
+        token = None
+    else:
+        token = store.put(zip_buffer)
+    return {
+        'is_batch': True,
+        'download_token': token,
+        'download_filename': f"Excel转Word_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+        'success_count': success_count,
+        'failed_count': len(failed),
+        'failed_files': [failed[idx] for idx in sorted(failed)],
+        'reports': [(files[idx][0], reports[idx]) for idx in sorted(reports)],
+    }
+
+# ---------- 后台任务 ----------
+@st.cache_resource
+def get_jobs() -> JobQueue:
+    """所有会话共用一个任务队列，同时运行的转换不超过 JOB_LIMIT 个"""
+    return JobQueue(JOB_LIMIT)
+
+def submit_conversion(uploaded_files, opts):
+    """读出上传内容交给任务队列，本会话记下任务 ID；转换本身不在脚本线程里跑"""
+    files = [(f.name, f.getvalue()) for f in uploaded_files]
+    # 预览里取消勾选了表格的文件用自己的设置
+    file_opts = {i: dict(opts, skip=skip) for i, skip in st.session_state.skips.items() if skip}
+    cache, store = get_cache(), get_results()
+    zip_mode = st.session_state.get('zip_mode', 'store')
+    trace_memory = st.session_state.get('trace_memory', False)
+    
+    def run(job: Job) -> dict:
+        if len(files) == 1:
+            return process_single_file(*files[0], file_opts.get(0, opts), cache, store, trace_memory, job)
+        return process_multiple_files(files, opts, cache, store, zip_mode, trace_memory, job, file_opts)
+    
+    label = files[0][0] if len(files) == 1 else f"{len(files)} 个文件"
+    st.session_state.job_id = get_jobs().submit(run, label).id
+
+def cancel_conversion():
+    if st.session_state.get('job_id'):
+        get_jobs().cancel(st.session_state.job_id)
+        st.session_state.job_id = None
+
+def drop_result():
+    """本会话上一次的结果不再需要，马上从暂存里释放"""
+    get_results().drop(st.session_state.get('download_token'))
+    st.session_state.download_token = None
+
+@st.fragment(run_every=1)
+def job_panel():
+    """每秒轮询本会话的任务：排队位置、进度、取消按钮；结束后取回结果并整页刷新"""
+    queue = get_jobs()
+    job = queue.get(st.session_state.job_id)
+    if job is not None and job.active:
+        if job.state == 'queued':
+            st.info(f"⏳ 排队中，前面还有 {queue.position(job)} 个任务")
         else:
-            # 即使全部失败也要保存状态
-            st.session_state.success_count = 0
-            st.session_state.failed_count = len(failed_files)
-            st.session_state.failed_files = failed_files
-            st.session_state.download_filename = f"Excel转Word_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-            
-            # 创建一个空的ZIP文件
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                # 创建一个空文件说明
-                info_file_content = "所有文件转换失败，请查看失败详情。".encode()
-                zip_file.writestr("转换说明.txt", info_file_content)
-            zip_buffer.seek(0)
-            
-            st.session_state.download_data = zip_buffer.getvalue()
+            st.progress(job.done / job.total if job.total else 0.0, text=job.text or "正在转换中...")
+        if st.button("⏹️ 取消转换", use_container_width=True, key="cancel_job"):
+            cancel_conversion()
+            st.toast("已取消转换")
+            st.rerun()
+        return
+    
+    st.session_state.job_id = None
+    if job is not None:
+        queue.forget(job.id)
+        if job.state == 'done':
+            st.session_state.update(job.result)
+            st.session_state.converted = True
+        elif job.state == 'failed':
+            st.session_state.update(success_count=0, failed_count=1, reports=[],
+                                    failed_files=[(job.label, job.error)])
             st.session_state.converted = True
+    st.rerun()
 
 # ---------- 侧边栏 ----------
 def sidebar_info():
@@ -524,7 +504,7 @@ def sidebar_info():
         st.markdown("""
         ### 简洁操作流程：
         1. **上传文件** 
-        2. **点击转换** 
+        2. **点击转换**（大文件可先点预览，去掉不需要的表格）
         3. **下载结果** 
         
         """)
@@ -543,10 +523,73 @@ def sidebar_info():
         
         st.markdown("---")
         
+        st.markdown("### ⚙️ 转换设置")
+        st.checkbox("精简输出", key="compact",
+                    help="格式写入文档样式，单元格只引用样式，文件更小、保存更快，显示效果不变")
+        st.radio("工作表", options=list(SHEET_MODES), key="sheet_mode",
+                 format_func=SHEET_MODES.get, horizontal=True,
+                 help="多个工作表时每个工作表单独一节，以表名作标题")
+        if st.session_state.get('sheet_mode') == 'pick':
+            st.text_input("工作表名称或序号", key="sheet_names", placeholder="如：汇总, 明细, 3",
+                          help="逗号分隔；序号从 1 开始")
+        st.checkbox("流式写出", key="stream", value=True,
+                    help="正文边生成边写进 .docx，不在内存里建整篇文档，几十万行的表也不会占满内存；结果与普通写出相同")
+        st.number_input("大表拆分行数", key="chunk_rows", min_value=0, value=0, step=1000,
+                        help="超过这么多行的表格拆成几张表，每张开头重复原表首行作表头；0 不拆分")
+        with st.expander("表格识别规则"):
+            st.number_input("无边框行最少非空单元格", key="rule_min_cells", min_value=1,
+                            value=RULE_INPUTS['min_cells'],
+                            help="没有上边框的行，非空单元格达到这么多才算表格行；有上边框的行总算表格行")
+            st.number_input("表格最少行数", key="rule_min_rows", min_value=1,
+                            value=RULE_INPUTS['min_rows'],
+                            help="行数不够的区域按普通段落输出，避免把零散的两三个值当成表格")
+            st.number_input("允许中断行数", key="rule_gap", min_value=0,
+                            value=RULE_INPUTS['gap'],
+                            help="表格中间夹着不超过这么多行的空行或说明行时，仍算同一张表")
+        st.radio("批量 ZIP 打包", options=list(ZIP_MODES), key="zip_mode",
+                 format_func=lambda m: {'store': "仅存储（更快）", 'deflate': "压缩"}[m],
+                 horizontal=True,
+                 help=".docx 本身已经压缩过，再压缩体积变化很小")
+        st.checkbox("统计内存峰值", key="trace_memory",
+                    help="转换统计里加上各阶段的内存峰值，转换会慢 2~3 倍，排查问题时再开")
+        jobs = get_jobs().counts()
+        st.caption(f"后台任务：运行中 {jobs['running']}/{jobs['limit']} · 排队 {jobs['queued']}")
+        
+        st.markdown("---")
+        
+        st.markdown("### 🗄️ 转换缓存")
+        cache = get_cache()
+        c1, c2, c3 = st.columns(3)
+        c1.metric("命中", cache.stats['hits'])
+        c2.metric("未命中", cache.stats['misses'])
+        c3.metric("淘汰", cache.stats['evictions'])
+        usage = f"内存 {cache.mem_size / 1024 / 1024:.1f}/{cache.mem_limit / 1024 / 1024:.0f} MB"
+        if cache.disk_dir:
+            usage += f" · 磁盘 {cache.disk_size / 1024 / 1024:.1f}/{cache.disk_limit / 1024 / 1024:.0f} MB"
+        st.caption(usage)
+        frags = frag_cache()
+        if frags is not None:
+            looked = frags.stats['hits'] + frags.stats['misses']
+            rate = f"{frags.stats['hits'] / looked:.0%}" if looked else "—"
+            st.caption(f"表格片段（单文件转换）：命中率 {rate} · {frags.mem_size / 1024 / 1024:.1f} MB")
+        
+        st.markdown("---")
+        
+        st.markdown("### 🧾 结果暂存")
+        store = get_results()
+        use = store.usage()
+        mb = 1024 * 1024
+        st.caption(f"{use['count']} 个待下载结果 · 内存 {use['mem'] / mb:.1f}/{use['mem_limit'] / mb:.0f} MB"
+                   f" · 临时文件 {use['disk'] / mb:.1f}/{use['disk_limit'] / mb:.0f} MB")
+        st.caption(f"单次上传上限 {st.get_option('server.maxUploadSize')} MB · "
+                   f"结果 {store.ttl / 60:.0f} 分钟未下载自动清除")
+        
+        st.markdown("---")
+        
         st.markdown("### ⚠️ 注意事项")
         st.markdown("""
-        1. 仅处理第一个工作表
-        2. 大文件请耐心等待
+        1. 默认只处理第一个工作表，可在转换设置里选择全部或指定工作表
+        2. 大文件请耐心等待，转换在后台排队进行，可随时取消
         """)
 
 if __name__ == "__main__":